@@ -1,39 +1,278 @@
+import multiprocessing
 import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from unstructured.partition.pdf import partition_pdf
 
+# "auto": plan pages and use hi_res only where needed; "hi_res": whole document hi_res
+PARTITION_STRATEGY = os.getenv("PARTITION_STRATEGY", "auto")
+# Processes used for the shards of one PDF (1 = sequential)
+PARTITION_SHARD_WORKERS = int(
+    os.getenv("PARTITION_SHARD_WORKERS", str(min(os.cpu_count() or 1, 4)))
+)
 
-def create_chunks_from_pdf(file_path):
-    """
-    Partition a single PDF into structured elements.
-    """
-    elements = partition_pdf(
+CHUNKING_KWARGS = {
+    "max_characters": 10000,
+    "combine_text_under_n_chars": 2000,
+    "new_after_n_chars": 6000,
+}
+HI_RES_KWARGS = {
+    "strategy": "hi_res",
+    "extract_images_in_pdf": True,
+    "extract_image_block_types": ["Image"],
+    "extract_image_block_to_payload": True,
+}
+# Partition workers are spawned, not forked: ingestion runs on background threads
+# (job queue, Streamlit), and forking a threaded process can deadlock the child on
+# locks held by other threads
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def _partition_hi_res(file_path):
+    return partition_pdf(
         filename=file_path,
-        strategy="hi_res",
-        extract_images_in_pdf=True,
-        extract_image_block_types=["Image"],
-        extract_image_block_to_payload=True,
         chunking_strategy="by_title",
-        max_characters=10000,
-        combine_text_under_n_chars=2000,
-        new_after_n_chars=6000,
+        **HI_RES_KWARGS,
+        **CHUNKING_KWARGS,
+    )
+
+
+def _partition_shard(file_path, strategy, first_page, last_page, whole_file=False):
+    """
+    Partition pages first_page..last_page of a PDF (unchunked elements) with the
+    given strategy, keeping the original page numbers and file name.
+    """
+    kwargs = HI_RES_KWARGS if strategy == "hi_res" else {"strategy": "fast"}
+    if whole_file:
+        return partition_pdf(filename=file_path, **kwargs)
+
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(file_path)
+    writer = PdfWriter()
+    for i in range(first_page - 1, last_page):
+        writer.add_page(reader.pages[i])
+
+    fd, shard_path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer.write(f)
+        return partition_pdf(
+            filename=shard_path,
+            metadata_filename=os.path.basename(file_path),
+            starting_page_number=first_page,
+            **kwargs,
+        )
+    finally:
+        os.remove(shard_path)
+
+
+def partition_pdf_sharded(file_path, max_workers=PARTITION_SHARD_WORKERS):
+    """
+    Page-sharded partitioning: pages are classified cheaply (see page_planner), only
+    those with images, table-like layout or no text layer go through hi_res while
+    the rest use the fast text-layer strategy. Shards run in parallel processes and
+    the combined elements are re-chunked by_title in page order.
+    """
+    from unstructured.chunking.title import chunk_by_title
+
+    from page_planner import plan_pdf
+
+    try:
+        pages, shards = plan_pdf(file_path)
+    except Exception as e:
+        # e.g. encrypted or malformed PDFs that unstructured can still read
+        print(f"⚠️ Could not plan pages of {file_path} ({e}), using hi_res.")
+        return _partition_hi_res(file_path)
+    hi_res_pages = sum(p["needs_hi_res"] for p in pages)
+    print(
+        f"🗺️ {os.path.basename(file_path)}: {hi_res_pages}/{len(pages)} pages need "
+        f"hi_res, {len(shards)} shard(s)."
     )
-    return elements
+
+    if len(shards) == 1:
+        shard = shards[0]
+        elements = _partition_shard(
+            file_path, shard["strategy"], 1, len(pages), whole_file=True
+        )
+    elif max_workers <= 1:
+        elements = []
+        for shard in shards:
+            elements += _partition_shard(
+                file_path, shard["strategy"], shard["first_page"], shard["last_page"]
+            )
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, len(shards)),
+            mp_context=_MP_CONTEXT,
+            initializer=_init_partition_worker,
+        ) as pool:
+            futures = [
+                pool.submit(
+                    _partition_shard,
+                    file_path,
+                    shard["strategy"],
+                    shard["first_page"],
+                    shard["last_page"],
+                )
+                for shard in shards
+            ]
+            # Shards are in page order, so concatenating keeps the reading order
+            elements = [el for future in futures for el in future.result()]
+
+    return chunk_by_title(elements, **CHUNKING_KWARGS)
+
+
+def create_chunks_from_pdf(file_path, max_workers=PARTITION_SHARD_WORKERS):
+    """
+    Partition a single PDF into structured elements.
+    """
+    if PARTITION_STRATEGY == "auto":
+        try:
+            return partition_pdf_sharded(file_path, max_workers=max_workers)
+        except ImportError as e:
+            print(f"⚠️ Page planning unavailable ({e}), using hi_res for every page.")
+    return _partition_hi_res(file_path)
+
+
+def list_pdf_files(directory_path):
+    """
+    Return the paths of all PDFs in a directory, in a stable order.
+    """
+    return [
+        os.path.join(directory_path, filename)
+        for filename in sorted(os.listdir(directory_path))
+        if filename.lower().endswith(".pdf")
+    ]
+
+
+def _init_partition_worker():
+    # One worker per core: keep each worker's torch/OpenMP pools single-threaded
+    os.environ["OMP_NUM_THREADS"] = "1"
+    try:
+        import torch
+
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
 
 
-def process_pdfs_in_directory(directory_path):
+def timed_partition(file_path, max_workers=PARTITION_SHARD_WORKERS):
+    """
+    Partition one PDF, capturing its wall time and any error instead of raising.
+    """
+    start = time.perf_counter()
+    try:
+        elements = create_chunks_from_pdf(file_path, max_workers=max_workers)
+        error = None
+    except Exception as e:
+        elements = []
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "file": file_path,
+        "elements": elements,
+        "seconds": time.perf_counter() - start,
+        "error": error,
+    }
+
+
+def resolve_pdf_files(input_path):
+    """
+    Return the PDF paths for a single PDF file or a directory of PDFs.
+    """
+    if os.path.isfile(input_path):
+        if not input_path.lower().endswith(".pdf"):
+            raise ValueError(f"File {input_path} is not a PDF")
+        return [input_path]
+    if os.path.isdir(input_path):
+        return list_pdf_files(input_path)
+    raise ValueError(f"Path {input_path} is neither a file nor a directory")
+
+
+def iter_pdfs_parallel(files, max_workers=None):
+    """
+    Partition the given PDFs in a worker process pool.
+    Yields one result dict per file (file, elements, seconds, error) as files complete.
+    """
+    if not files:
+        return
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(files))
+    crashed = []
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=_MP_CONTEXT,
+        initializer=_init_partition_worker,
+    ) as pool:
+        # Files are already spread over processes, so their shards run sequentially
+        futures = {pool.submit(timed_partition, f, 1): f for f in files}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                crashed.append(futures[future])
+            except Exception as e:
+                # e.g. the worker's result could not be pickled back
+                yield {
+                    "file": futures[future],
+                    "elements": [],
+                    "seconds": 0.0,
+                    "error": f"{type(e).__name__}: {e}",
+                }
+
+    # A hard crash (e.g. segfault) breaks every pending future of the pool, so retry
+    # the affected files one by one in isolated processes to pin down the culprit.
+    for file_path in crashed:
+        start = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=_MP_CONTEXT,
+                initializer=_init_partition_worker,
+            ) as pool:
+                yield pool.submit(timed_partition, file_path, 1).result()
+        except BrokenProcessPool as e:
+            yield {
+                "file": file_path,
+                "elements": [],
+                "seconds": time.perf_counter() - start,
+                "error": f"Worker process crashed: {e}",
+            }
+
+
+def process_pdfs_in_directory(directory_path, parallel=False, max_workers=None):
     """
     Process all PDFs in a directory and return all elements.
+    With parallel=True, files are partitioned in a process pool sized to the CPU count.
     """
     all_elements = []
-    for filename in os.listdir(directory_path):
-        if filename.lower().endswith(".pdf"):
-            file_path = os.path.join(directory_path, filename)
+
+    if not parallel:
+        for file_path in list_pdf_files(directory_path):
             elements = create_chunks_from_pdf(file_path)
             all_elements.extend(elements)
+        return all_elements
+
+    files = list_pdf_files(directory_path)
+    for result in iter_pdfs_parallel(files, max_workers=max_workers):
+        filename = os.path.basename(result["file"])
+        if result["error"]:
+            print(
+                f"❌ {filename} failed after {result['seconds']:.1f}s: {result['error']}"
+            )
+            continue
+        print(
+            f"⏱️ {filename}: {len(result['elements'])} elements in {result['seconds']:.1f}s"
+        )
+        all_elements.extend(result["elements"])
+
     return all_elements
 
 
-def process_pdf_input(input_path):
+def process_pdf_input(input_path, parallel=False, max_workers=None):
     """
     Process either a single PDF file or all PDFs in a directory.
     """
@@ -46,7 +285,9 @@ def process_pdf_input(input_path):
         else:
             raise ValueError(f"File {input_path} is not a PDF")
     elif os.path.isdir(input_path):
-        all_elements = process_pdfs_in_directory(input_path)
+        all_elements = process_pdfs_in_directory(
+            input_path, parallel=parallel, max_workers=max_workers
+        )
     else:
         raise ValueError(f"Path {input_path} is neither a file nor a directory")
 
@@ -70,15 +311,24 @@ def table_text_segregation(all_elements):
     return tables, texts
 
 
-def get_images(chunks):
-    """
-    Extract images from CompositeElements.
-    """
-    images_b64 = []
+def _image_elements(chunks):
     for chunk in chunks:
         if "CompositeElement" in str(type(chunk)):
             chunk_els = chunk.metadata.orig_elements
             for el in chunk_els:
                 if "Image" in str(type(el)):
-                    images_b64.append(el.metadata.image_base64)
-    return images_b64
+                    yield el
+
+
+def get_images(chunks):
+    """
+    Extract images from CompositeElements.
+    """
+    return [el.metadata.image_base64 for el in _image_elements(chunks)]
+
+
+def get_image_page_numbers(chunks):
+    """
+    Page numbers of the images returned by get_images, in the same order.
+    """
+    return [getattr(el.metadata, "page_number", None) for el in _image_elements(chunks)]
@@ -1,54 +1,444 @@
-from Ingestion import process_pdf_input, table_text_segregation, get_images
+from Ingestion import (
+    table_text_segregation,
+    get_images,
+    get_image_page_numbers,
+    iter_pdfs_parallel,
+    resolve_pdf_files,
+    timed_partition,
+)
 from summarizer import summarize_texts_tables, summarize_images
-from VectorDB import add_documents_to_vector_db
+from VectorDB import (
+    add_documents_to_vector_db,
+    delete_documents_from_vector_db,
+    get_chunk_store_path,
+    get_manifest_path,
+    get_metrics_path,
+    save_indexes,
+)
+from manifest import IngestionManifest, file_sha256
+from dedup import DEDUP_ENABLED, find_duplicates
+from image_utils import normalize_images
+from telemetry import increment, observe, span, write_metrics
 
-from chunk_creator import export_text_chunks, export_image_chunks
+from chunk_creator import export_text_chunks, export_table_chunks, export_image_chunks
+from chunk_store import get_chunk_store
 import os
+import queue
+import threading
 
+_STAGE_DONE = object()
 
-def ingestion_chain(file_path, retriever):
+
+def _deduplicate(batch, dedup_index, source=None):
     """
-    Complete ingestion pipeline: PDF → extract → summarize → add to vector DB.
+    Drop near-duplicate texts, tables and images from a segregated batch before
+    summarization. Duplicates of other files' stored documents are listed in
+    batch["linked_ids"] so the file references the existing summary and vector
+    instead of a new one.
     """
-    try:
-        from ollama_running import ensure_ollama_running
-
-        ensure_ollama_running()
+    batch["fingerprints"], batch["linked_ids"] = {}, []
+    for key, modality in (("texts", "text"), ("tables", "table"), ("images", "image")):
+        elements = batch[key]
+        keep, fingerprints, linked = find_duplicates(
+            elements, modality, dedup_index, source
+        )
+        batch[key] = [elements[i] for i in keep]
+        if modality == "image":
+            for aligned in ("image_pages", "image_originals"):
+                batch[aligned] = [batch[aligned][i] for i in keep]
+        batch["fingerprints"][modality] = fingerprints
+        batch["linked_ids"] += linked
+        skipped = len(elements) - len(keep)
+        if skipped:
+            increment("duplicates_skipped", skipped, modality=modality)
+            print(f"♻️ Skipped {skipped} near-duplicate {modality} element(s).")
+    return batch
 
-        # Extract elements from PDF
-        elements = process_pdf_input(file_path)
-        print(f"✅ Extracted {len(elements)} elements from PDF.")
 
-        # Segregate into tables, texts, images
+def summarize_elements(elements, dedup_index=None, source=None):
+    """
+    Segregate partitioned elements and summarize their texts, tables and images.
+    Near-duplicates (repeated within the batch or of other sources' documents in
+    dedup_index) are not summarized (see _deduplicate).
+    """
+    # Segregate into tables, texts, images
+    with span("segregation"):
         tables, texts = table_text_segregation(elements)
         images = get_images(elements)
-        print(
-            f"📄 Texts: {len(texts)}, 📊 Tables: {len(tables)}, 🖼️ Images: {len(images)}"
+        image_pages = get_image_page_numbers(elements)
+    originals = images
+    with span("image_normalize"):
+        images = normalize_images(images)
+    increment("elements", len(texts), modality="text")
+    increment("elements", len(tables), modality="table")
+    increment("elements", len(images), modality="image")
+    print(f"📄 Texts: {len(texts)}, 📊 Tables: {len(tables)}, 🖼️ Images: {len(images)}")
+
+    batch = {"texts": texts, "tables": tables, "images": images}
+    batch["image_pages"] = image_pages
+    # Models and the docstore get the normalized images; the chunk store keeps these
+    batch["image_originals"] = originals
+    if DEDUP_ENABLED:
+        with span("dedup"):
+            batch = _deduplicate(batch, dedup_index, source)
+
+    # Summarize
+    batch["text_summaries"], batch["table_summaries"] = summarize_texts_tables(
+        batch["texts"], batch["tables"]
+    )
+    batch["img_summaries"] = summarize_images(batch["images"])
+    print("✅ Summarization complete.")
+
+    return batch
+
+
+def commit_batch(batch, file_path, retriever, manifest=None, sha256=None):
+    """
+    Export the chunks of a summarized batch and add them to the vector DB.
+    With a manifest, the file's previous chunks that are no longer present are
+    deleted and the file's hash and chunk IDs are recorded.
+    """
+    source_pdf = os.path.basename(file_path)
+    # Same IDs as the vector DB, in the retriever's (tenant's) own chunk store
+    store = get_chunk_store(get_chunk_store_path(retriever))
+    tenant_id = getattr(retriever, "tenant_id", None)
+    with span("chunk_export"):
+        export_text_chunks(
+            texts=batch["texts"],
+            source_pdf=source_pdf,
+            store=store,
+            tenant_id=tenant_id,
         )
+        export_table_chunks(
+            tables=batch["tables"],
+            source_pdf=source_pdf,
+            store=store,
+            tenant_id=tenant_id,
+        )
+        export_image_chunks(
+            images_b64=batch["images"],
+            source_pdf=source_pdf,
+            page_numbers=batch.get("image_pages"),
+            originals=batch.get("image_originals"),
+            store=store,
+            tenant_id=tenant_id,
+        )
+    print("✅ Chunks exported to the chunk store.")
 
-        # Summarize
-        text_summaries, table_summaries = summarize_texts_tables(texts, tables)
-        img_summaries = summarize_images(images)
-        print("✅ Summarization complete.")
-        export_text_chunks(texts=texts, source_pdf=os.path.basename(file_path))
-
-        export_image_chunks(images_b64=images, source_pdf=os.path.basename(file_path))
-        print("✅ Chunks exported to JSONL files.")
-
-        # Add to vector DB
-        add_documents_to_vector_db(
-            texts,
-            text_summaries,
-            tables,
-            table_summaries,
-            images,
-            img_summaries,
+    # Add to vector DB
+    with span("vector_db_add"):
+        doc_ids = add_documents_to_vector_db(
+            batch["texts"],
+            batch["text_summaries"],
+            batch["tables"],
+            batch["table_summaries"],
+            batch["images"],
+            batch["img_summaries"],
             retriever=retriever,
+            source=source_pdf,
+            fingerprints=batch.get("fingerprints"),
+        )
+    print("✅ Documents added to vector database.")
+
+    # Near-duplicates reference the stored canonical documents (kept while referenced)
+    linked = batch.get("linked_ids") or []
+    if linked:
+        found = retriever.docstore.mget(linked)
+        linked = [d for d, doc in zip(linked, found) if doc is not None]
+        doc_ids = list(dict.fromkeys(doc_ids + linked))
+
+    if manifest is not None:
+        stale = set(manifest.doc_ids(file_path)) - set(doc_ids)
+        _delete_documents(
+            manifest.unreferenced(sorted(stale), exclude_source=file_path), retriever
         )
-        print("✅ Documents added to vector database.")
+        manifest.record(file_path, sha256, doc_ids)
+        manifest.save()
+
+    return doc_ids
+
+
+def _delete_documents(doc_ids, retriever):
+    delete_documents_from_vector_db(doc_ids, retriever)
+    if doc_ids:
+        # Chunk store records share the vector DB IDs
+        store = get_chunk_store(get_chunk_store_path(retriever))
+        store.delete(doc_ids)
+        store.flush()
+
+
+def plan_ingestion(input_path, retriever, incremental=True):
+    """
+    Work out which PDFs need (re)ingesting.
+    Returns (manifest, [(file_path, sha256), ...]). In incremental mode unchanged files
+    are skipped and files removed from an ingested directory are purged from the store.
+    """
+    files = resolve_pdf_files(input_path)
+    manifest_path = get_manifest_path(retriever) if incremental else None
+    if manifest_path is None:
+        return None, [(f, None) for f in files]
+
+    manifest = IngestionManifest(manifest_path)
+
+    if os.path.isdir(input_path):
+        for source in manifest.missing_sources(input_path, files):
+            print(f"🗑️ {source} was removed, purging its documents.")
+            _delete_documents(
+                manifest.unreferenced(manifest.doc_ids(source), exclude_source=source),
+                retriever,
+            )
+            manifest.remove(source)
+        manifest.save()
+
+    todo = []
+    for file_path in files:
+        sha256 = file_sha256(file_path)
+        if manifest.is_unchanged(file_path, sha256):
+            print(f"⏭️ {os.path.basename(file_path)} is unchanged, skipping.")
+        else:
+            todo.append((file_path, sha256))
+
+    return manifest, todo
+
+
+class IngestionCancelled(Exception):
+    pass
+
+
+def _report(progress, file_path, stage):
+    if progress is not None:
+        progress(file_path, stage)
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise IngestionCancelled("Ingestion cancelled")
+
+
+def ingestion_chain(
+    file_path,
+    retriever,
+    parallel=False,
+    streaming=False,
+    incremental=True,
+    progress=None,
+    cancel_event=None,
+):
+    """
+    Complete ingestion pipeline: PDF → extract → summarize → add to vector DB.
+    With parallel=True, PDFs in a directory are partitioned in a process pool.
+    With streaming=True, files flow through overlapped stages one at a time
+    (see streaming_ingestion_chain).
+    With incremental=True, unchanged files are skipped and the chunks of modified or
+    removed files are replaced (see plan_ingestion).
+    A file that fails is reported and skipped without stopping the others; the run
+    raises RuntimeError at the end if any file failed.
+    progress(file_path, stage) is called as each file enters the "partition",
+    "summarize", "commit" and "done" stages, and setting cancel_event stops the run
+    with IngestionCancelled before the next stage (non-streaming mode only).
+    """
+    if streaming:
+        return streaming_ingestion_chain(file_path, retriever, incremental=incremental)
+
+    try:
+        from ollama_running import ensure_ollama_running
+
+        manifest, todo = plan_ingestion(file_path, retriever, incremental)
+        if not todo:
+            print("✅ Nothing to ingest, all files are up to date.")
+            return True
+
+        ensure_ollama_running()
+
+        hashes = dict(todo)
+        dedup_index = getattr(retriever, "dedup_index", None)
+        if parallel:
+            for f in hashes:
+                _report(progress, f, "partition")
+            results = iter_pdfs_parallel(list(hashes))
+        else:
+
+            def partition_each():
+                for f in hashes:
+                    _check_cancelled(cancel_event)
+                    _report(progress, f, "partition")
+                    yield timed_partition(f)
+
+            results = partition_each()
+
+        failures = []
+        for result in results:
+            _record_partition(result)
+            if result["error"]:
+                # Other files keep going; this one stays out of the manifest
+                failures.append((result["file"], result["error"]))
+                continue
+
+            # Extract elements from PDF
+            elements = result["elements"]
+            print(f"✅ Extracted {len(elements)} elements from {result['file']}.")
+
+            try:
+                _check_cancelled(cancel_event)
+                _report(progress, result["file"], "summarize")
+                batch = summarize_elements(
+                    elements, dedup_index, os.path.basename(result["file"])
+                )
+
+                _check_cancelled(cancel_event)
+                _report(progress, result["file"], "commit")
+                commit_batch(
+                    batch, result["file"], retriever, manifest, hashes[result["file"]]
+                )
+            except IngestionCancelled:
+                raise
+            except Exception as e:
+                failures.append((result["file"], e))
+                continue
+            _report(progress, result["file"], "done")
+
+        for failed_file, error in failures:
+            print(f"❌ Error ingesting {failed_file}: {str(error)}")
+        if failures:
+            raise RuntimeError(
+                f"Ingestion failed for {len(failures)} of {len(hashes)} file(s)."
+            )
 
         return True
 
+    except IngestionCancelled:
+        print("🛑 Ingestion cancelled.")
+        raise
+
     except Exception as e:
         print(f"❌ Error in ingestion pipeline: {str(e)}")
         raise RuntimeError(f"Ingestion failed: {str(e)}")
+
+    finally:
+        save_indexes(retriever)
+        write_metrics(get_metrics_path(retriever))
+
+
+def _record_partition(result):
+    # Partitioning may run in worker processes, so record it from the returned timing
+    labels = {"error": result["error"].split(":")[0]} if result["error"] else {}
+    observe("partition", result["seconds"], **labels)
+    increment("elements_partitioned", len(result["elements"]))
+    if os.path.exists(result["file"]):
+        increment("pdf_bytes", os.path.getsize(result["file"]))
+
+
+def _put(q, item, stop):
+    # Blocking put that gives up once the pipeline is being torn down
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _STAGE_DONE
+
+
+def streaming_ingestion_chain(input_path, retriever, queue_size=1, incremental=True):
+    """
+    Streaming ingestion pipeline for a PDF file or directory.
+
+    Partitioning, summarization and vector DB commits run as concurrent stages joined
+    by bounded queues, so partitioning file N+1, summarizing file N and committing
+    file N-1 overlap. A full queue blocks the upstream stage (backpressure), keeping
+    memory bounded by queue_size files regardless of corpus size. Each file becomes
+    queryable as soon as its batch is committed; a failing file is reported and
+    skipped without stopping the others.
+    """
+    from ollama_running import ensure_ollama_running
+
+    manifest, todo = plan_ingestion(input_path, retriever, incremental)
+    files = [f for f, _ in todo]
+    hashes = dict(todo)
+    if not files:
+        print("✅ Nothing to ingest, all files are up to date.")
+        return True
+
+    ensure_ollama_running()
+
+    partitioned = queue.Queue(maxsize=queue_size)
+    summarized = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    failures = []
+    dedup_index = getattr(retriever, "dedup_index", None)
+
+    def partition_stage():
+        for file_path in files:
+            result = timed_partition(file_path)
+            _record_partition(result)
+            if result["error"]:
+                failures.append((file_path, result["error"]))
+                continue
+            elements = result["elements"]
+            print(f"✅ Extracted {len(elements)} elements from {file_path}.")
+            if not _put(partitioned, (file_path, elements), stop):
+                return
+        _put(partitioned, _STAGE_DONE, stop)
+
+    def summarize_stage():
+        while True:
+            item = _get(partitioned, stop)
+            if item is _STAGE_DONE:
+                break
+            file_path, elements = item
+            try:
+                batch = summarize_elements(
+                    elements, dedup_index, os.path.basename(file_path)
+                )
+            except Exception as e:
+                failures.append((file_path, e))
+                continue
+            if not _put(summarized, (file_path, batch), stop):
+                return
+        _put(summarized, _STAGE_DONE, stop)
+
+    workers = [
+        threading.Thread(target=partition_stage, name="ingest-partition", daemon=True),
+        threading.Thread(target=summarize_stage, name="ingest-summarize", daemon=True),
+    ]
+    for worker in workers:
+        worker.start()
+
+    committed = 0
+    try:
+        # Commit stage runs on the calling thread
+        while True:
+            item = _get(summarized, stop)
+            if item is _STAGE_DONE:
+                break
+            file_path, batch = item
+            try:
+                commit_batch(batch, file_path, retriever, manifest, hashes[file_path])
+                committed += 1
+                print(f"📥 Committed {file_path} ({committed}/{len(files)}).")
+            except Exception as e:
+                failures.append((file_path, e))
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+        save_indexes(retriever)
+        write_metrics(get_metrics_path(retriever))
+
+    for file_path, e in failures:
+        print(f"❌ Error ingesting {file_path}: {str(e)}")
+    if failures:
+        raise RuntimeError(
+            f"Ingestion failed for {len(failures)} of {len(files)} file(s)."
+        )
+
+    return True
@@ -1,37 +1,251 @@
-import uuid
-from langchain_chroma import Chroma
+import os
+from typing import Any
+
 from langchain_core.stores import InMemoryStore
 from langchain_core.documents import Document
 from langchain_classic.retrievers import MultiVectorRetriever
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_classic.retrievers.multi_vector import SearchType
+from langchain_core.runnables.config import run_in_executor
+
+from answer_cache import SemanticAnswerCache
+from chunk_store import CHUNK_STORE_DIR
+from dedup import DEDUP_ENABLED, NearDuplicateIndex, fingerprint
+from docstore import SQLiteDocStore
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from manifest import element_content, make_chunk_id
+from registry import get_embedding_model, get_reranker
+from reranker import RERANK_ENABLED, RERANK_FETCH_K
+from telemetry import increment, span
+
+# "dense" (vector search only) or "hybrid" (BM25 + vectors fused with RRF)
+DEFAULT_SEARCH_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+# "chroma" or "mmap" (memory-mapped flat/IVF index, see mmap_vectorstore.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# Adds and deletes re-pickle the BM25 and near-duplicate indexes at most this often;
+# ingestion flushes them at the end of the run (see save_indexes)
+INDEX_SAVE_INTERVAL = float(os.getenv("INDEX_SAVE_INTERVAL_SECONDS", "60"))
+
+
+class HybridMultiVectorRetriever(MultiVectorRetriever):
+    """
+    MultiVectorRetriever that can fuse dense summary search with a BM25 index over
+    summaries and raw chunk text (reciprocal rank fusion) before the docstore lookup.
+    Accepts k and search_mode per call, e.g. retriever.invoke(q, k=3, search_mode="hybrid").
+    With a reranker, rerank_fetch_k candidates are fetched and reranked down to k
+    (disable per call with rerank=False).
+    """
+
+    lexical_index: Any = None
+    search_mode: str = DEFAULT_SEARCH_MODE
+    rrf_k: int = 60
+    # Bumped on every add/delete so caches built on query results can be invalidated
+    corpus_version: int = 0
+    answer_cache: Any = None
+    # Set on tenant-scoped retrievers sharing one store (see tenants.py)
+    tenant_id: Any = None
+    reranker: Any = None
+    rerank_fetch_k: int = RERANK_FETCH_K
+    # Fingerprints of stored documents for near-duplicate detection (see dedup.py)
+    dedup_index: Any = None
+
+    def _unique_ids(self, metadatas):
+        ids = []
+        for metadata in metadatas:
+            doc_id = (metadata or {}).get(self.id_key)
+            if doc_id and doc_id not in ids:
+                ids.append(doc_id)
+        return ids
+
+    def _dense_ids(self, query, k):
+        search_kwargs = {**self.search_kwargs, "k": k}
+        if self.search_type == SearchType.mmr:
+            sub_docs = self.vectorstore.max_marginal_relevance_search(
+                query, **search_kwargs
+            )
+        else:
+            sub_docs = self.vectorstore.similarity_search(query, **search_kwargs)
+        return self._unique_ids(d.metadata for d in sub_docs)
+
+    def _dense_ids_batch(self, queries, k):
+        """
+        Dense search for many queries: one embedding batch and, on Chroma or the mmap
+        backend, one query.
+        """
+        embeddings = self.vectorstore.embeddings
+        # Queries must not land in the on-disk document embedding cache
+        embed = getattr(embeddings, "embed_queries", embeddings.embed_documents)
+        vectors = embed(list(queries))
+        collection = getattr(self.vectorstore, "_collection", None)
+        search_many = getattr(self.vectorstore, "similarity_search_by_vectors", None)
+
+        if collection is not None and self.search_type != SearchType.mmr:
+            result = collection.query(
+                query_embeddings=vectors,
+                n_results=k,
+                where=self.search_kwargs.get("filter"),
+                include=["metadatas"],
+            )
+            return [self._unique_ids(m) for m in result["metadatas"]]
+
+        if search_many is not None and self.search_type != SearchType.mmr:
+            results = search_many(vectors, k=k, filter=self.search_kwargs.get("filter"))
+            return [self._unique_ids(d.metadata for d in docs) for docs in results]
 
+        search_kwargs = {**self.search_kwargs, "k": k}
+        if self.search_type == SearchType.mmr:
+            search = self.vectorstore.max_marginal_relevance_search_by_vector
+        else:
+            search = self.vectorstore.similarity_search_by_vector
+        return [
+            self._unique_ids(d.metadata for d in search(v, **search_kwargs))
+            for v in vectors
+        ]
+
+    def _search_plan(self, k, search_mode, rerank=None):
+        """
+        Returns (k, hybrid, rerank, n_candidates, fetch_k): the number of fused
+        candidates to fetch from the docstore and per-retriever search depth.
+        """
+        k = k or self.search_kwargs.get("k", 4)
+        search_mode = search_mode or self.search_mode
+        hybrid = search_mode == "hybrid" and self.lexical_index is not None
+        rerank = self.reranker is not None and rerank is not False
+        n_candidates = max(k, self.rerank_fetch_k) if rerank else k
+        fetch_k = max(4 * n_candidates, 20) if hybrid else n_candidates
+        return k, hybrid, rerank, n_candidates, fetch_k
+
+    def _fuse(self, query, dense_ids, k, hybrid, fetch_k):
+        if not hybrid:
+            return dense_ids[:k]
+        lexical_ids = [
+            doc_id for doc_id, _ in self.lexical_index.search(query, fetch_k)
+        ]
+        return reciprocal_rank_fusion([dense_ids, lexical_ids], k=self.rrf_k)[:k]
+
+    def _get_relevant_documents(
+        self, query, *, run_manager, k=None, search_mode=None, rerank=None
+    ):
+        k, hybrid, rerank, n, fetch_k = self._search_plan(k, search_mode, rerank)
+        with span("retrieval", mode="hybrid" if hybrid else "dense"):
+            ids = self._fuse(query, self._dense_ids(query, fetch_k), n, hybrid, fetch_k)
+        with span("docstore_fetch"):
+            docs = [d for d in self.docstore.mget(ids) if d is not None]
+        if rerank:
+            return self.reranker.rerank(query, docs, k)
+        return docs
+
+    def batch_retrieve(self, queries, k=None, search_mode=None, rerank=None):
+        """
+        Retrieve for many queries at once: embeddings in one batch, vector searches in
+        bulk and a single docstore mget for all hits. Returns one list per query.
+        """
+        k, hybrid, rerank, n, fetch_k = self._search_plan(k, search_mode, rerank)
+        with span("batch_retrieval", mode="hybrid" if hybrid else "dense"):
+            dense = self._dense_ids_batch(queries, fetch_k)
+            ranked = [
+                self._fuse(q, ids, n, hybrid, fetch_k) for q, ids in zip(queries, dense)
+            ]
+
+        all_ids = list(dict.fromkeys(i for ids in ranked for i in ids))
+        with span("docstore_fetch"):
+            found = dict(zip(all_ids, self.docstore.mget(all_ids)))
+        results = [[found[i] for i in ids if found[i] is not None] for ids in ranked]
+        if rerank:
+            results = [self.reranker.rerank(q, d, k) for q, d in zip(queries, results)]
+        return results
+
+    async def _aget_relevant_documents(
+        self, query, *, run_manager, k=None, search_mode=None, rerank=None
+    ):
+        return await run_in_executor(
+            None,
+            self._get_relevant_documents,
+            query,
+            run_manager=run_manager.get_sync(),
+            k=k,
+            search_mode=search_mode,
+            rerank=rerank,
+        )
 
-def initialize_vector_db(persist_directory="./chroma_store"):
+
+def initialize_vector_db(
+    persist_directory="./chroma_store",
+    persistent_docstore=True,
+    search_mode=DEFAULT_SEARCH_MODE,
+    embedding_model=None,
+    rerank=RERANK_ENABLED,
+    vector_backend=VECTOR_BACKEND,
+):
     """
     Initialize the vector database and multi-vector retriever.
+    Original chunks, tables and images are kept in a SQLite docstore next to the vector
+    files so they survive restarts; pass persistent_docstore=False for an InMemoryStore.
+    A BM25 index is maintained alongside for search_mode="hybrid", and a
+    near-duplicate index so repeated content links to already stored documents.
+    The embedding model defaults to the process-wide shared instance, so only the
+    collection and docstore handles are per retriever.
+    With rerank=True, results are reranked by the shared cross-encoder (reranker.py).
+    vector_backend selects Chroma or the memory-mapped flat index; switching backend
+    requires re-ingesting.
     """
-    embedding_model = HuggingFaceEmbeddings(
-        model="BAAI/bge-small-en-v1.5", model_kwargs={"device": "cpu"}
-    )
+    embedding_model = embedding_model or get_embedding_model()
 
-    vectorstore = Chroma(
-        collection_name="multi_modal_rag",
-        embedding_function=embedding_model,
-        persist_directory=persist_directory,
-    )
+    if vector_backend == "mmap":
+        from mmap_vectorstore import MemmapVectorStore
 
-    store = InMemoryStore()
+        vectorstore = MemmapVectorStore(persist_directory, embedding_model)
+    elif vector_backend == "chroma":
+        from langchain_chroma import Chroma
+
+        vectorstore = Chroma(
+            collection_name="multi_modal_rag",
+            embedding_function=embedding_model,
+            persist_directory=persist_directory,
+        )
+    else:
+        raise ValueError(f"Unknown vector backend: {vector_backend}")
+
+    if persistent_docstore:
+        store = SQLiteDocStore(os.path.join(persist_directory, "docstore.sqlite"))
+        lexical_index = BM25Index(os.path.join(persist_directory, "bm25_index.pkl"))
+        dedup_path = os.path.join(persist_directory, "dedup_index.pkl")
+    else:
+        store = InMemoryStore()
+        lexical_index = BM25Index()
+        dedup_path = None
     id_key = "doc_id"
 
-    multi_retriever = MultiVectorRetriever(
+    multi_retriever = HybridMultiVectorRetriever(
         vectorstore=vectorstore,
         docstore=store,
         id_key=id_key,
+        lexical_index=lexical_index,
+        search_mode=search_mode,
+        answer_cache=SemanticAnswerCache(embedding_model),
+        reranker=get_reranker() if rerank else None,
+        dedup_index=NearDuplicateIndex(dedup_path) if DEDUP_ENABLED else None,
     )
 
     return multi_retriever
 
 
+def to_tagged_document(element, modality, metadata):
+    """
+    Wrap an original element as a Document tagged with its modality and source, so
+    retrieval can dispatch on metadata instead of inspecting the content.
+    """
+    metadata = dict(metadata, modality=modality)
+    el_metadata = getattr(element, "metadata", None)
+    page_number = getattr(el_metadata, "page_number", None)
+    if page_number is not None:
+        metadata["page_number"] = page_number
+    if modality == "table":
+        text_as_html = getattr(el_metadata, "text_as_html", None)
+        if text_as_html:
+            metadata["text_as_html"] = text_as_html
+    return Document(page_content=element_content(element), metadata=metadata)
+
+
 def add_documents_to_vector_db(
     texts,
     text_summaries,
@@ -41,9 +255,17 @@ def add_documents_to_vector_db(
     img_summaries,
     retriever,
     id_key="doc_id",
+    source=None,
+    fingerprints=None,
 ):
     """
     Adds original documents and their summaries to the multi-vector retriever.
+    IDs are derived from the source name and element content, so re-adding the same
+    chunk overwrites it instead of duplicating it. Returns the list of IDs added.
+    fingerprints ({"text": [...], ...}, aligned with the elements) are recorded in the
+    retriever's near-duplicate index; missing ones are computed. The lexical and
+    near-duplicate indexes are saved at most every INDEX_SAVE_INTERVAL seconds: call
+    save_indexes(retriever) when done adding.
     """
 
     # --- SAFETY WRAPPER (fixes .strip() crash) ---
@@ -55,35 +277,153 @@ def add_documents_to_vector_db(
         return str(x)
 
     def process_and_add(elements, summaries, label):
-        docs, pairs = [], []
-        for elem, summary in zip(elements, summaries):
+        docs, pairs, fps = [], [], []
+        seen = set()
+        label_fps = (fingerprints or {}).get(label)
+        for i, (elem, summary) in enumerate(zip(elements, summaries)):
 
             summary = _safe_string(summary)  # <-- REQUIRED FIX
 
             if summary and summary.strip():
-                uid = str(uuid.uuid4())
-                docs.append(
-                    Document(page_content=summary.strip(), metadata={id_key: uid})
+                uid = make_chunk_id(
+                    source or "", label, element_content(elem), tenant_id=tenant_id
                 )
-                pairs.append((uid, elem))
+                if uid in seen:
+                    continue
+                seen.add(uid)
+                metadata = {id_key: uid, "modality": label, "source": source or ""}
+                if tenant_id:
+                    metadata["tenant_id"] = tenant_id
+                docs.append(Document(page_content=summary.strip(), metadata=metadata))
+                pairs.append((uid, to_tagged_document(elem, label, metadata)))
+                if dedup_index is not None:
+                    fp = label_fps[i] if label_fps else fingerprint(label, elem)
+                    fps.append((uid, label, fp, source))
 
         if docs:
-            retriever.vectorstore.add_documents(docs)
-            retriever.docstore.mset(pairs)
+            ids = [uid for uid, _ in pairs]
+            # Includes embedding the summaries (also recorded as the "embedding" stage)
+            with span("vector_insert", modality=label):
+                retriever.vectorstore.add_documents(docs, ids=ids)
+            with span("docstore_write", modality=label):
+                retriever.docstore.mset(pairs)
+            if lexical_index is not None:
+                with span("lexical_index", modality=label):
+                    lexical_index.add_many(
+                        (
+                            (uid, f"{doc.page_content}\n{orig.page_content}")
+                            if label != "image"
+                            else (uid, doc.page_content)
+                        )
+                        for doc, (uid, orig) in zip(docs, pairs)
+                    )
+            if dedup_index is not None:
+                dedup_index.add_many(fps)
+            increment("documents_added", len(docs), modality=label)
             print(f"✅ Added {len(docs)} {label} summaries.")
         else:
             print(f"⚠️ No {label} summaries to add.")
+        return [uid for uid, _ in pairs]
+
+    lexical_index = getattr(retriever, "lexical_index", None)
+    dedup_index = getattr(retriever, "dedup_index", None)
+    tenant_id = getattr(retriever, "tenant_id", None)
+
+    doc_ids = []
+    doc_ids += process_and_add(texts, text_summaries, "text")
+    doc_ids += process_and_add(tables, table_summaries, "table")
+    doc_ids += process_and_add(images, img_summaries, "image")
+
+    save_indexes(retriever, min_interval=INDEX_SAVE_INTERVAL)
+    if doc_ids:
+        _bump_corpus_version(retriever)
+    return doc_ids
+
 
-    process_and_add(texts, text_summaries, "text")
-    process_and_add(tables, table_summaries, "table")
-    process_and_add(images, img_summaries, "image")
+def save_indexes(retriever, min_interval=0.0):
+    """
+    Persist the retriever's lexical and near-duplicate indexes if they changed.
+    """
+    for index in (
+        getattr(retriever, "lexical_index", None),
+        getattr(retriever, "dedup_index", None),
+    ):
+        if index is not None:
+            with span("index_save"):
+                index.save(min_interval=min_interval)
+
+
+def _bump_corpus_version(retriever):
+    if hasattr(retriever, "corpus_version"):
+        retriever.corpus_version += 1
+
+
+def delete_documents_from_vector_db(doc_ids, retriever):
+    """
+    Remove summaries and their original documents by ID (indexes are saved as in
+    add_documents_to_vector_db).
+    """
+    if not doc_ids:
+        return
+    retriever.vectorstore.delete(ids=list(doc_ids))
+    retriever.docstore.mdelete(list(doc_ids))
+    lexical_index = getattr(retriever, "lexical_index", None)
+    if lexical_index is not None:
+        lexical_index.remove_many(doc_ids)
+    dedup_index = getattr(retriever, "dedup_index", None)
+    if dedup_index is not None:
+        dedup_index.remove_many(doc_ids)
+    save_indexes(retriever, min_interval=INDEX_SAVE_INTERVAL)
+    _bump_corpus_version(retriever)
+    print(f"🗑️ Removed {len(doc_ids)} stale documents.")
+
+
+def get_manifest_path(retriever):
+    """
+    Location of the ingestion manifest for a retriever (next to its vector store),
+    or None when the vectors or originals are not persisted.
+    """
+    persist_directory = getattr(retriever.vectorstore, "_persist_directory", None)
+    if not persist_directory or not isinstance(retriever.docstore, SQLiteDocStore):
+        return None
+    tenant_id = getattr(retriever, "tenant_id", None)
+    if tenant_id:
+        return os.path.join(persist_directory, "tenants", tenant_id, "manifest.json")
+    return os.path.join(persist_directory, "manifest.json")
+
+
+def get_metrics_path(retriever):
+    """
+    Default Prometheus snapshot location for a retriever: next to its vector store
+    (shared by all tenants), or None when the vectors are not persisted.
+    """
+    persist_directory = getattr(retriever.vectorstore, "_persist_directory", None)
+    if not persist_directory:
+        return None
+    return os.path.join(persist_directory, "metrics.prom")
+
+
+def get_chunk_store_path(retriever):
+    """
+    Chunk store directory for a retriever: CHUNK_STORE_DIR, or for a tenant a store
+    inside its tenant directory, so purging the tenant deletes its chunks too.
+    """
+    tenant_id = getattr(retriever, "tenant_id", None)
+    if not tenant_id:
+        return CHUNK_STORE_DIR
+    persist_directory = getattr(retriever.vectorstore, "_persist_directory", None)
+    if persist_directory:
+        return os.path.join(persist_directory, "tenants", tenant_id, "chunk_store")
+    return os.path.join(CHUNK_STORE_DIR, "tenants", tenant_id)
 
 
-def retrieve_documents(retriever, question, k=3):
+def retrieve_documents(retriever, question, k=3, search_mode=None, rerank=None):
     """
     Retrieve documents from vector database.
+    search_mode is "dense" or "hybrid" (defaults to the retriever's search_mode).
+    rerank=False skips the retriever's reranker for this call.
     """
-    docs = retriever.invoke(question, kw_args={"k": k})
+    docs = retriever.invoke(question, k=k, search_mode=search_mode, rerank=rerank)
     return docs
 
 
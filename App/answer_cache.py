@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from telemetry import increment, observe
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+
+def _normalize_question(question):
+    return " ".join(question.lower().split())
+
+
+class SemanticAnswerCache:
+    """
+    Answer cache keyed by question embedding: a question whose cosine similarity to a
+    cached one reaches the threshold reuses its answer. Entries expire after ttl
+    seconds, the least recently used are evicted beyond max_entries, and everything is
+    dropped when the corpus version changes.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        threshold=ANSWER_CACHE_THRESHOLD,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        ttl=ANSWER_CACHE_TTL,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # normalized question -> entry dict
+        self._corpus_version = None
+        self.metrics = {
+            "hits": 0,
+            "misses": 0,
+            "hit_seconds": 0.0,
+            "miss_seconds": 0.0,
+            "invalidations": 0,
+        }
+
+    def _sync_version(self, corpus_version):
+        if corpus_version != self._corpus_version:
+            if self._entries:
+                self.metrics["invalidations"] += 1
+            self._entries.clear()
+            self._corpus_version = corpus_version
+
+    def _expire(self, now):
+        expired = [
+            key for key, e in self._entries.items() if now - e["created_at"] > self.ttl
+        ]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, question, corpus_version):
+        """
+        Return (answer, embedding). answer is None on a miss; the embedding (None if an
+        exact match made it unnecessary) can be passed back to store().
+        """
+        key = _normalize_question(question)
+        now = time.time()
+
+        with self._lock:
+            self._sync_version(corpus_version)
+            self._expire(now)
+            # Exact (normalized) repeats skip the embedding entirely
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]["answer"], None
+            keys = list(self._entries)
+            matrix = (
+                np.stack([self._entries[k]["vector"] for k in keys]) if keys else None
+            )
+
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        if matrix is None:
+            return None, vector
+
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None, vector
+
+        with self._lock:
+            entry = self._entries.get(keys[best])
+            if entry is None:
+                return None, vector
+            self._entries.move_to_end(keys[best])
+            return entry["answer"], vector
+
+    def store(self, question, answer, corpus_version, vector=None):
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+
+        with self._lock:
+            if corpus_version != self._corpus_version:
+                # Corpus changed while this answer was being generated
+                return
+            key = _normalize_question(question)
+            self._entries[key] = {
+                "vector": vector,
+                "answer": answer,
+                "created_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record(self, hit, seconds):
+        increment("cache_lookups", cache="answer", result="hit" if hit else "miss")
+        observe("answer", seconds, cached=hit)
+        with self._lock:
+            if hit:
+                self.metrics["hits"] += 1
+                self.metrics["hit_seconds"] += seconds
+            else:
+                self.metrics["misses"] += 1
+                self.metrics["miss_seconds"] += seconds
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics, entries=len(self._entries))
+        stats["avg_hit_seconds"] = stats["hit_seconds"] / max(stats["hits"], 1)
+        stats["avg_miss_seconds"] = stats["miss_seconds"] / max(stats["misses"], 1)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
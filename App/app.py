@@ -1,13 +1,15 @@
 import streamlit as st
-import tempfile
 import os
-import shutil
-import atexit
 import uuid
+from functools import partial
 
-from Ingestion_chain import ingestion_chain
-from retrieval_chain import answer_question
-from VectorDB import initialize_vector_db
+from ingestion_jobs import get_ingestion_queue
+from retrieval_chain import stream_answer
+from telemetry import start_metrics_server
+from tenants import QuotaExceededError, get_tenant_manager
+
+# Expose /metrics when METRICS_PORT is set (once per process, shared by all sessions)
+start_metrics_server()
 
 # Page configuration
 st.set_page_config(
@@ -15,32 +17,27 @@ st.set_page_config(
     layout="wide",
 )
 
-# Initialize session state
+# All sessions share one store; each session is a tenant with its own documents.
+# The tenant id lives in the URL so a reload reattaches to the same documents.
+tenants = get_tenant_manager()
+jobs = get_ingestion_queue()
+
 if "session_id" not in st.session_state:
-    st.session_state.session_id = str(uuid.uuid4())
-    st.session_state.temp_dir = os.path.join(
-        tempfile.gettempdir(), f"streamlit_rag_session_{st.session_state.session_id}"
-    )
-    st.session_state.chroma_dir = os.path.join(
-        st.session_state.temp_dir, "chroma_store"
-    )
+    tenant_id = st.query_params.get("tenant") or uuid.uuid4().hex
+    try:
+        tenants.tenant_dir(tenant_id)
+    except ValueError:
+        tenant_id = uuid.uuid4().hex
+    st.query_params["tenant"] = tenant_id
+
+    st.session_state.session_id = tenant_id
     st.session_state.messages = []
-    st.session_state.files_uploaded = False
-    st.session_state.retriever = None
-    st.session_state.retriever = initialize_vector_db(st.session_state.chroma_dir)
+    st.session_state.files_uploaded = tenants.usage(tenant_id)["files"] > 0
+    st.session_state.uploader_key = 0
+    st.session_state.notified_jobs = set()
 
-    os.makedirs(st.session_state.temp_dir, exist_ok=True)
-    os.makedirs(st.session_state.chroma_dir, exist_ok=True)
-
-
-# Cleanup function
-@atexit.register
-def cleanup():
-    if "session_id" in st.session_state and os.path.exists(st.session_state.temp_dir):
-        try:
-            shutil.rmtree(st.session_state.temp_dir)
-        except Exception:
-            pass
+# Released automatically when idle; rebuilt from the shared store on demand
+retriever = tenants.get_retriever(st.session_state.session_id)
 
 
 # Sidebar
@@ -64,50 +61,91 @@ with st.sidebar:
         type=["pdf"],
         accept_multiple_files=True,
         help="Upload one or more PDF files to create your knowledge base",
+        # A new key clears the uploader once its files have been queued
+        key=f"uploader_{st.session_state.uploader_key}",
     )
 
-    if uploaded_files and not st.session_state.files_uploaded:
+    if uploaded_files:
         if st.button("Process Files", type="primary", use_container_width=True):
-            with st.spinner("Processing files..."):
-                success_count = 0
-                error_count = 0
-
+            tenant_id = st.session_state.session_id
+            try:
+                tenants.check_quota(
+                    tenant_id,
+                    len(uploaded_files),
+                    sum(f.size for f in uploaded_files),
+                )
+            except QuotaExceededError as e:
+                st.error(str(e))
+            else:
+                upload_dir = tenants.upload_dir(tenant_id)
                 for uploaded_file in uploaded_files:
-                    try:
-                        file_path = os.path.join(
-                            st.session_state.temp_dir, uploaded_file.name
-                        )
-                        with open(file_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-
-                        ingestion_chain(file_path, st.session_state.retriever)
-                        success_count += 1
-
-                    except Exception as e:
-                        error_count += 1
-                        st.error(f"Error processing {uploaded_file.name}: {str(e)}")
-
-                if success_count > 0:
-                    st.success(f"✅ Successfully processed {success_count} file(s)!")
-                    st.session_state.files_uploaded = True
-                    st.session_state.messages.append(
-                        {
-                            "role": "system",
-                            "content": f"Successfully processed {success_count} PDF file(s). You can now ask questions about your documents.",
-                        }
+                    file_path = os.path.join(
+                        upload_dir, os.path.basename(uploaded_file.name)
+                    )
+                    with open(file_path, "wb") as f:
+                        f.write(uploaded_file.getbuffer())
+                    # Resolved when the job starts, and pinned while it runs
+                    jobs.submit(
+                        file_path,
+                        open_retriever=partial(tenants.pinned, tenant_id),
+                        owner=tenant_id,
                     )
-                    st.rerun()
+                tenants.record_upload(
+                    tenant_id, len(uploaded_files), sum(f.size for f in uploaded_files)
+                )
+                st.session_state.uploader_key += 1
+                st.rerun()
+
+    @st.fragment(run_every=2)
+    def ingestion_progress():
+        """Poll the background jobs of this session without rerunning the page."""
+        session_jobs = jobs.jobs(owner=st.session_state.session_id)
+        for job in session_jobs:
+            if job["status"] in ("queued", "running"):
+                st.progress(job["progress"], text=f"{job['file_name']}: {job['stage']}")
+                st.button(
+                    "Cancel",
+                    key=f"cancel_{job['id']}",
+                    on_click=jobs.cancel,
+                    args=(job["id"],),
+                )
+            elif job["status"] == "done":
+                st.caption(f"✅ {job['file_name']} ({job['seconds']:.0f}s)")
+            elif job["status"] == "failed":
+                st.caption(f"❌ {job['file_name']}: {job['error']}")
+            else:
+                st.caption(f"🛑 {job['file_name']} cancelled")
+
+        newly_done = [
+            j
+            for j in session_jobs
+            if j["status"] == "done" and j["id"] not in st.session_state.notified_jobs
+        ]
+        if newly_done:
+            st.session_state.notified_jobs.update(j["id"] for j in newly_done)
+            names = ", ".join(j["file_name"] for j in newly_done)
+            st.session_state.messages.append(
+                {
+                    "role": "system",
+                    "content": f"Processed {names}. You can now ask questions about it while the remaining files finish.",
+                }
+            )
+            st.session_state.files_uploaded = True
+            # Full rerun so the chat input and messages appear
+            st.rerun(scope="app")
 
-                if error_count > 0:
-                    st.warning(f"⚠️ {error_count} file(s) failed to process.")
+    ingestion_progress()
 
     if st.session_state.files_uploaded:
         st.success("✅ Files ready for queries")
         if st.button("Clear All & Reset", use_container_width=True):
-            if os.path.exists(st.session_state.temp_dir):
-                shutil.rmtree(st.session_state.temp_dir)
+            for job in jobs.jobs(owner=st.session_state.session_id):
+                jobs.cancel(job["id"])
+            jobs.clear_finished(owner=st.session_state.session_id)
+            tenants.purge_tenant(st.session_state.session_id)
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
+            st.query_params.clear()
             st.rerun()
 
 # Main content
@@ -154,11 +192,37 @@ if st.session_state.files_uploaded:
     if user_query:
         st.session_state.messages.append({"role": "user", "content": user_query})
 
+        st.markdown(
+            f"""<div style='background-color: #DCF8C6; padding: 15px; border-radius: 10px; margin: 10px 0; margin-left: 20%;'>
+            <p style='margin: 0; color: #333;'><strong>You:</strong> {user_query}</p>
+            </div>""",
+            unsafe_allow_html=True,
+        )
+
         try:
-            with st.spinner("Thinking..."):
-                answer = answer_question(user_query, st.session_state.retriever)
+            placeholder = st.empty()
+            sources = ""
+            answer = ""
+            with st.spinner("Searching documents..."):
+                events = stream_answer(user_query, retriever)
+                first = next(events)
+            if first["sources"]:
+                sources = (
+                    f"<br><small>📚 Sources: {', '.join(first['sources'])}</small>"
+                )
+
+            for event in events:
+                answer += event["content"]
+                placeholder.markdown(
+                    f"""<div style='background-color: #E8EAF6; padding: 15px; border-radius: 10px; margin: 10px 0; margin-right: 20%;'>
+                    <p style='margin: 0; color: #333;'><strong>🤖 Bot:</strong> {answer}{sources}</p>
+                    </div>""",
+                    unsafe_allow_html=True,
+                )
 
-            st.session_state.messages.append({"role": "assistant", "content": answer})
+            st.session_state.messages.append(
+                {"role": "assistant", "content": answer + sources}
+            )
         except Exception as e:
             error_message = f"Sorry, I encountered an error: {str(e)}"
             st.session_state.messages.append(
@@ -0,0 +1,346 @@
+"""
+Offline benchmark for ingestion and retrieval.
+
+Replaces partition_pdf, ChatOllama, ChatOpenAI and (by default) the embedding model with
+deterministic local stand-ins with configurable simulated latency, generates a synthetic
+corpus, and measures ingestion throughput, retrieve_documents/answer_question latency
+percentiles and peak RSS at several corpus sizes. Each size runs in a fresh process
+with its own caches and stores, so sizes neither share cached summaries nor inherit
+each other's peak RSS. Results are written as JSON so runs can be compared across
+commits:
+
+    python benchmark.py --sizes 10 50 200 --output benchmark_results.json
+"""
+
+import argparse
+import base64
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+WORDS = (
+    "attention encoder decoder layer token embedding vector matrix pump valve "
+    "pressure sensor calibration table figure protocol latency throughput model "
+    "training dataset gradient optimizer batch memory cache index query retrieval "
+    "summary document"
+).split()
+
+
+# ===== STAND-INS =====
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model with simulated latency (first token + per token)."""
+
+    latency: float = 0.05
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "benchmark-fake"
+
+    def _reply(self, messages):
+        content = messages[-1].content
+        if isinstance(content, list):
+            content = " ".join(
+                part.get("text", "") for part in content if isinstance(part, dict)
+            )
+        words = content.split()
+        return "Summary: " + " ".join(words[-12:])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        text = self._reply(messages)
+        time.sleep(self.token_latency * len(text.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for word in self._reply(messages).split():
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+# Class names matter: Ingestion segregates elements by their type name
+class CompositeElement:
+    def __init__(self, text, page_number, images=()):
+        self.text = text
+        self.metadata = SimpleNamespace(
+            page_number=page_number, orig_elements=list(images)
+        )
+
+    def __str__(self):
+        return self.text
+
+
+class Table:
+    def __init__(self, text, html, page_number):
+        self.text = text
+        self.metadata = SimpleNamespace(text_as_html=html, page_number=page_number)
+
+    def __str__(self):
+        return self.text
+
+
+class Image:
+    def __init__(self, image_base64, page_number):
+        self.text = ""
+        self.metadata = SimpleNamespace(
+            image_base64=image_base64, page_number=page_number
+        )
+
+
+def _synthetic_image(rng):
+    try:
+        from PIL import Image as PILImage
+
+        # Random blocks, so near-duplicate detection does not merge the images
+        img = PILImage.new("L", (8, 8))
+        img.putdata([rng.randint(0, 255) for _ in range(64)])
+        size = (rng.randint(200, 1600), rng.randint(200, 1200))
+        img = img.resize(size, PILImage.NEAREST).convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        data = buffer.getvalue()
+    except ImportError:
+        data = bytes(rng.getrandbits(8) for _ in range(2048))
+    return base64.b64encode(data).decode("ascii")
+
+
+def synthetic_elements(seed, n_elements, table_ratio=0.1, image_ratio=0.1):
+    """
+    Deterministic unstructured-like elements for one synthetic PDF.
+    """
+    rng = random.Random(seed)
+    elements = []
+    for i in range(n_elements):
+        page = i // 3 + 1
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(150, 600)))
+        text += f" ID-{seed}-{i}"
+        roll = rng.random()
+        if roll < table_ratio:
+            rows = "".join(
+                f"<tr><td>{rng.choice(WORDS)}</td><td>{rng.randint(0, 999)}</td></tr>"
+                for _ in range(8)
+            )
+            elements.append(Table(text[:400], f"<table>{rows}</table>", page))
+        elif roll < table_ratio + image_ratio:
+            images = [Image(_synthetic_image(rng), page)]
+            elements.append(CompositeElement(text, page, images))
+        else:
+            elements.append(CompositeElement(text, page))
+    return elements
+
+
+def write_synthetic_corpus(directory, n_files):
+    """
+    Write placeholder PDFs; their contents seed the synthetic elements.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for i in range(n_files):
+        with open(os.path.join(directory, f"doc_{i:05d}.pdf"), "w") as f:
+            f.write(str(i))
+
+
+# ===== MEASUREMENT =====
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "p50_ms": pick(50) * 1000,
+        "p95_ms": pick(95) * 1000,
+        "p99_ms": pick(99) * 1000,
+        "mean_ms": statistics.mean(ordered) * 1000,
+    }
+
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process in MB (main() runs every size in its own process), or
+    None when the platform offers no way to measure it.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        return peak / (1024 * 1024) if peak is not None else None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def install_stand_ins(args, workdir):
+    """
+    Patch the pipeline modules to use the local stand-ins.
+    """
+    import Ingestion
+    import Ingestion_chain
+    import VectorDB
+    import ollama_running
+    import registry
+    import retrieval_chain
+    import summarizer
+    import summary_cache
+
+    registry.clear_registry()
+    ollama = FakeChatModel(latency=args.llm_latency)
+    openai = FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency)
+    summarizer.get_chat_ollama = lambda model, **kwargs: ollama
+    retrieval_chain.get_chat_openai = lambda *a, **kwargs: openai
+
+    if not args.real_embeddings:
+        fake_embeddings = DeterministicFakeEmbedding(size=384)
+        VectorDB.get_embedding_model = lambda: fake_embeddings
+
+    summary_cache._default_cache = summary_cache.SummaryCache(
+        os.path.join(workdir, "summary_cache.sqlite")
+    )
+
+    def fake_partition(file_path, **kwargs):
+        time.sleep(args.partition_latency)
+        with open(file_path) as f:
+            seed = int(f.read())
+        return synthetic_elements(seed, args.elements_per_file)
+
+    def fake_iter_pdfs_parallel(files, max_workers=None):
+        # Spawned partition workers would not see the patched partitioner; the fake
+        # one only sleeps, so threads overlap it just like processes would
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+            futures = [pool.submit(Ingestion.timed_partition, f, 1) for f in files]
+            for future in as_completed(futures):
+                yield future.result()
+
+    Ingestion.create_chunks_from_pdf = fake_partition
+    Ingestion_chain.iter_pdfs_parallel = fake_iter_pdfs_parallel
+    ollama_running.ensure_ollama_running = lambda: None
+
+
+def run_size(n_files, args, workdir):
+    from Ingestion_chain import ingestion_chain
+    from VectorDB import initialize_vector_db, retrieve_documents
+    from retrieval_chain import answer_question
+
+    corpus_dir = os.path.join(workdir, f"corpus_{n_files}")
+    store_dir = os.path.join(workdir, f"store_{n_files}")
+    write_synthetic_corpus(corpus_dir, n_files)
+    retriever = initialize_vector_db(store_dir, vector_backend=args.vector_backend)
+
+    start = time.perf_counter()
+    ingestion_chain(corpus_dir, retriever, streaming=args.streaming)
+    ingest_seconds = time.perf_counter() - start
+    n_elements = n_files * args.elements_per_file
+
+    rng = random.Random(n_files)
+    queries = [
+        " ".join(rng.choice(WORDS) for _ in range(8)) for _ in range(args.queries)
+    ]
+
+    retrieval = []
+    for query in queries:
+        start = time.perf_counter()
+        retrieve_documents(retriever, query, k=3)
+        retrieval.append(time.perf_counter() - start)
+
+    answering = []
+    for query in queries:
+        start = time.perf_counter()
+        answer_question(query, retriever, use_cache=False)
+        answering.append(time.perf_counter() - start)
+
+    return {
+        "files": n_files,
+        "elements": n_elements,
+        "ingest_seconds": ingest_seconds,
+        "elements_per_second": n_elements / ingest_seconds,
+        "retrieve_documents": percentiles(retrieval),
+        "answer_question": percentiles(answering),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_size_isolated(n_files, args, workdir):
+    """
+    Install the stand-ins and benchmark one size inside workdir. Meant to run in a
+    fresh process, so caches and peak RSS start from zero.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    # The chunk store and caches are created relative to the working directory
+    os.chdir(workdir)
+    install_stand_ins(args, workdir)
+    return run_size(n_files, args, workdir)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except FileNotFoundError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--elements-per-file", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.02)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--partition-latency", type=float, default=0.05)
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--real-embeddings", action="store_true")
+    parser.add_argument(
+        "--vector-backend", choices=["chroma", "mmap"], default="chroma"
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    results = []
+    spawn = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="rag_bench_") as workdir:
+        for i, n_files in enumerate(args.sizes):
+            print(f"\n🏁 Benchmarking {n_files} file(s)...")
+            size_dir = os.path.join(workdir, f"size_{i}_{n_files}")
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                future = pool.submit(run_size_isolated, n_files, args, size_dir)
+                results.append(future.result())
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": vars(args),
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Benchmark results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
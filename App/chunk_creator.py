@@ -1,35 +1,62 @@
 # chunk_exporter.py
-import json
-import uuid
-
-
-def export_text_chunks(texts, source_pdf, output_file="chunks.jsonl"):
-    with open(output_file, "a", encoding="utf-8") as f:
-        for text in texts:
-            raw_text = text.text if hasattr(text, "text") else str(text)
-
-            record = {
-                "chunk_id": str(uuid.uuid4()),
-                "modality": "text",
-                "source_pdf": source_pdf,
-                "page_number": None,
-                "raw_text": raw_text,
-                "image_b64": None,
-                "gold_questions": [],
-            }
-            f.write(json.dumps(record) + "\n")
-
-
-def export_image_chunks(images_b64, source_pdf, output_file="chunks.jsonl"):
-    with open(output_file, "a", encoding="utf-8") as f:
-        for img in images_b64:
-            record = {
-                "chunk_id": str(uuid.uuid4()),
-                "modality": "image",
-                "source_pdf": source_pdf,
-                "page_number": None,
-                "raw_text": None,
-                "image_b64": img,
-                "gold_questions": [],
-            }
-            f.write(json.dumps(record) + "\n")
+from base64 import b64decode
+
+from chunk_store import get_chunk_store
+from manifest import element_content, make_chunk_id
+
+
+def _page_number(element):
+    return getattr(getattr(element, "metadata", None), "page_number", None)
+
+
+def _export_elements(elements, source_pdf, modality, store, tenant_id):
+    store = store or get_chunk_store()
+    added = 0
+    for element in elements:
+        raw_text = element_content(element)
+        added += store.add(
+            make_chunk_id(source_pdf, modality, raw_text, tenant_id=tenant_id),
+            modality,
+            source_pdf,
+            page_number=_page_number(element),
+            text=raw_text,
+        )
+    store.flush()
+    return added
+
+
+def export_text_chunks(texts, source_pdf, store=None, tenant_id=None):
+    return _export_elements(texts, source_pdf, "text", store, tenant_id)
+
+
+def export_table_chunks(tables, source_pdf, store=None, tenant_id=None):
+    return _export_elements(tables, source_pdf, "table", store, tenant_id)
+
+
+def export_image_chunks(
+    images_b64,
+    source_pdf,
+    page_numbers=None,
+    store=None,
+    tenant_id=None,
+    originals=None,
+):
+    """
+    Export images under the chunk ids of images_b64 (as stored in the vector DB).
+    With originals (aligned base64 images before normalization), the original bytes
+    are stored instead, so evaluation jobs see the full-resolution image.
+    """
+    store = store or get_chunk_store()
+    page_numbers = page_numbers or [None] * len(images_b64)
+    originals = originals or images_b64
+    added = 0
+    for img, original, page_number in zip(images_b64, originals, page_numbers):
+        added += store.add(
+            make_chunk_id(source_pdf, "image", img, tenant_id=tenant_id),
+            "image",
+            source_pdf,
+            page_number=page_number,
+            blob=b64decode(original),
+        )
+    store.flush()
+    return added
@@ -0,0 +1,359 @@
+import base64
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import uuid
+
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", "chunk_store")
+
+MODALITIES = ("text", "table", "image")
+NO_PAGE = -1
+
+# records.bin: append-only records, each a fixed header followed by the source name
+# and UTF-8 text. Header: chunk id, modality, page number, source length, text length,
+# sha256 of the image blob (zeros for text/table records).
+RECORD_HEADER = struct.Struct("<16sBiHI32s")
+
+# index.bin: header (magic, entry count, records.bin size it covers) followed by
+# fixed-width (chunk id, offset, length) entries sorted by chunk id, so readers can
+# binary-search it in place.
+INDEX_MAGIC = b"RAGCHK01"
+INDEX_HEADER = struct.Struct("<8sQQ")
+INDEX_ENTRY = struct.Struct("<16sQI")
+
+_NO_BLOB = bytes(32)
+
+
+def _id_bytes(chunk_id):
+    return uuid.UUID(str(chunk_id)).bytes
+
+
+def _decode_record(buffer, offset):
+    chunk_id, modality, page, source_len, text_len, digest = RECORD_HEADER.unpack_from(
+        buffer, offset
+    )
+    start = offset + RECORD_HEADER.size
+    source = bytes(buffer[start : start + source_len]).decode("utf-8")
+    start += source_len
+    text = bytes(buffer[start : start + text_len]).decode("utf-8")
+    return {
+        "chunk_id": str(uuid.UUID(bytes=chunk_id)),
+        "modality": MODALITIES[modality],
+        "source_pdf": source,
+        "page_number": None if page == NO_PAGE else page,
+        "raw_text": text if MODALITIES[modality] != "image" else None,
+        "image_sha256": digest.hex() if digest != _NO_BLOB else None,
+    }
+
+
+def _scan_records(buffer, start, end):
+    """
+    Yield (chunk id bytes, offset, length) for the records in buffer[start:end].
+    """
+    offset = start
+    while offset + RECORD_HEADER.size <= end:
+        chunk_id, _, _, source_len, text_len, _ = RECORD_HEADER.unpack_from(
+            buffer, offset
+        )
+        length = RECORD_HEADER.size + source_len + text_len
+        if offset + length > end:
+            break  # Torn write at the tail
+        yield chunk_id, offset, length
+        offset += length
+
+
+class ChunkStore:
+    """
+    Writer for the on-disk chunk store used by evaluation jobs:
+
+        chunk_store/records.bin   text/table records and image references
+        chunk_store/index.bin     sorted chunk_id → record offset index
+        chunk_store/blobs/ab/...  image bytes, one file per sha256 (deduplicated)
+
+    Chunk IDs are content-derived, so re-exporting the same chunk is a no-op.
+    Use ChunkStoreReader for random access by chunk_id.
+    """
+
+    def __init__(self, path=CHUNK_STORE_DIR):
+        self.path = path
+        self.records_path = os.path.join(path, "records.bin")
+        self.index_path = os.path.join(path, "index.bin")
+        self.blob_dir = os.path.join(path, "blobs")
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        self._index = {}
+        self._dirty = False
+        indexed_size = self._load_index()
+        self._records = open(self.records_path, "ab")
+        self._size = self._records.tell()
+        if self._size > indexed_size:
+            # Records appended after the last index flush (e.g. a crash): re-index them
+            self._reindex_tail(indexed_size)
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return 0
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        magic, count, records_size = INDEX_HEADER.unpack_from(data, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{self.index_path} is not a chunk store index")
+        for i in range(count):
+            chunk_id, offset, length = INDEX_ENTRY.unpack_from(
+                data, INDEX_HEADER.size + i * INDEX_ENTRY.size
+            )
+            self._index[chunk_id] = (offset, length)
+        return records_size
+
+    def _reindex_tail(self, start):
+        with open(self.records_path, "rb") as f:
+            f.seek(start)
+            tail = f.read()
+        end = start
+        for chunk_id, offset, length in _scan_records(tail, 0, len(tail)):
+            self._index[chunk_id] = (start + offset, length)
+            end = start + offset + length
+        if end < self._size:
+            # Drop a torn record so later appends stay aligned
+            self._records.truncate(end)
+            self._records.seek(end)
+            self._size = end
+        self._dirty = True
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def _write_blob(self, data):
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return sha256
+
+    def add(self, chunk_id, modality, source, page_number=None, text="", blob=None):
+        """
+        Append one chunk. Returns False when the chunk_id is already stored.
+        """
+        key = _id_bytes(chunk_id)
+        with self._lock:
+            if key in self._index:
+                return False
+            digest = bytes.fromhex(self._write_blob(blob)) if blob else _NO_BLOB
+            source_bytes = (source or "").encode("utf-8")
+            text_bytes = (text or "").encode("utf-8")
+            header = RECORD_HEADER.pack(
+                key,
+                MODALITIES.index(modality),
+                NO_PAGE if page_number is None else int(page_number),
+                len(source_bytes),
+                len(text_bytes),
+                digest,
+            )
+            record = header + source_bytes + text_bytes
+            self._records.write(record)
+            self._index[key] = (self._size, len(record))
+            self._size += len(record)
+            self._dirty = True
+            return True
+
+    def delete(self, chunk_ids):
+        """
+        Drop chunks from the index; their bytes are reclaimed by compact().
+        """
+        with self._lock:
+            for chunk_id in chunk_ids:
+                if self._index.pop(_id_bytes(chunk_id), None) is not None:
+                    self._dirty = True
+
+    def flush(self):
+        """
+        Make appended records durable and rewrite the index atomically.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            self._records.flush()
+            os.fsync(self._records.fileno())
+            self._write_index()
+            self._dirty = False
+
+    def _write_index(self):
+        entries = sorted(self._index.items())
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(entries), self._size))
+            for chunk_id, (offset, length) in entries:
+                f.write(INDEX_ENTRY.pack(chunk_id, offset, length))
+        os.replace(tmp_path, self.index_path)
+
+    def compact(self):
+        """
+        Rewrite records.bin with only indexed records and delete unreferenced blobs.
+        """
+        with self._lock:
+            self._records.flush()
+            live = sorted(self._index.items(), key=lambda item: item[1][0])
+            tmp_path = f"{self.records_path}.tmp"
+            index, referenced, size = {}, set(), 0
+            with open(self.records_path, "rb") as src, open(tmp_path, "wb") as dst:
+                for chunk_id, (offset, length) in live:
+                    src.seek(offset)
+                    record = src.read(length)
+                    dst.write(record)
+                    index[chunk_id] = (size, length)
+                    size += length
+                    digest = RECORD_HEADER.unpack_from(record, 0)[5]
+                    if digest != _NO_BLOB:
+                        referenced.add(digest.hex())
+            self._records.close()
+            os.replace(tmp_path, self.records_path)
+            self._records = open(self.records_path, "ab")
+            self._index, self._size = index, size
+            self._write_index()
+            self._dirty = False
+
+        for root, _, files in os.walk(self.blob_dir):
+            for name in files:
+                if name not in referenced:
+                    os.remove(os.path.join(root, name))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, chunk_id):
+        return _id_bytes(chunk_id) in self._index
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._records.close()
+
+
+class ChunkStoreReader:
+    """
+    Read-only view of a chunk store. The index and records are memory-mapped, so
+    opening is O(1) and get(chunk_id) is a binary search plus one record decode.
+    """
+
+    def __init__(self, path=CHUNK_STORE_DIR):
+        self.path = path
+        self.blob_dir = os.path.join(path, "blobs")
+        self._index = self._map(os.path.join(path, "index.bin"))
+        self._records = self._map(os.path.join(path, "records.bin"))
+
+        self._count = 0
+        if self._index is not None:
+            magic, self._count, _ = INDEX_HEADER.unpack_from(self._index, 0)
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"{path} is not a chunk store")
+
+    @staticmethod
+    def _map(file_path):
+        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            return None
+        with open(file_path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _entry(self, i):
+        return INDEX_ENTRY.unpack_from(
+            self._index, INDEX_HEADER.size + i * INDEX_ENTRY.size
+        )
+
+    def _lookup(self, chunk_id):
+        key = _id_bytes(chunk_id)
+        # The index is sorted by chunk id; search it where it lies in the mapping
+        ids = _IndexKeys(self)
+        i = bisect.bisect_left(ids, key)
+        if i < self._count and ids[i] == key:
+            return self._entry(i)
+        return None
+
+    def get(self, chunk_id):
+        """
+        Return the chunk's record dict, or None if it is not stored.
+        """
+        entry = self._lookup(chunk_id)
+        if entry is None:
+            return None
+        return _decode_record(self._records, entry[1])
+
+    def get_image(self, chunk_id):
+        """
+        Return the raw image bytes of an image chunk, or None.
+        """
+        record = self.get(chunk_id)
+        if record is None or record["image_sha256"] is None:
+            return None
+        sha256 = record["image_sha256"]
+        with open(os.path.join(self.blob_dir, sha256[:2], sha256), "rb") as f:
+            return f.read()
+
+    def get_image_b64(self, chunk_id):
+        data = self.get_image(chunk_id)
+        return base64.b64encode(data).decode("ascii") if data is not None else None
+
+    def __iter__(self):
+        """
+        Iterate over all records in file order (sequential reads of the mapping).
+        """
+        offsets = sorted(self._entry(i)[1] for i in range(self._count))
+        for offset in offsets:
+            yield _decode_record(self._records, offset)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, chunk_id):
+        return self._lookup(chunk_id) is not None
+
+    def close(self):
+        for mapping in (self._index, self._records):
+            if mapping is not None:
+                mapping.close()
+
+
+class _IndexKeys:
+    """Sequence view over the chunk ids in a mapped index, for bisect."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return self.reader._count
+
+    def __getitem__(self, i):
+        offset = INDEX_HEADER.size + i * INDEX_ENTRY.size
+        return bytes(self.reader._index[offset : offset + 16])
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_chunk_store(path=CHUNK_STORE_DIR):
+    """
+    Return the process-wide chunk store writer for path, creating it on first use.
+    """
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ChunkStore(path)
+        return _stores[path]
+
+
+def close_chunk_store(path):
+    """
+    Close and forget the writer for path (e.g. before its directory is deleted).
+    """
+    with _stores_lock:
+        store = _stores.pop(os.path.abspath(path), None)
+    if store is not None:
+        store.close()
@@ -35,6 +35,8 @@ def initialize_retriever():
 @atexit.register
 def cleanup():
     """Delete vector database on exit."""
+    if retriever is not None and hasattr(retriever.docstore, "close"):
+        retriever.docstore.close()
     if os.path.exists(VECTOR_DB_DIR):
         try:
             shutil.rmtree(VECTOR_DB_DIR)
@@ -86,7 +88,7 @@ def run_ingestion():
     print(f"\n🚀 Running ingestion from: {data_path}")
     try:
         ret = initialize_retriever()
-        ingestion_chain(data_path, ret)
+        ingestion_chain(data_path, ret, parallel=os.path.isdir(data_path))
         print("✅ Ingestion complete!")
     except Exception as e:
         print(f"❌ Ingestion failed: {e}")
@@ -94,7 +96,7 @@ def run_ingestion():
 
 def run_chat():
     """Interactive chat loop with the RAG system."""
-    from retrieval_chain import answer_question
+    from retrieval_chain import stream_answer
 
     ret = initialize_retriever()
 
@@ -124,14 +126,23 @@ def run_chat():
             continue
 
         try:
-            response = answer_question(query, ret)
-            print(f"\n🤖 Bot: {response}\n")
+            for event in stream_answer(query, ret):
+                if event["type"] == "sources":
+                    if event["sources"]:
+                        print(f"\n📚 Sources: {', '.join(event['sources'])}")
+                    print("\n🤖 Bot: ", end="", flush=True)
+                else:
+                    print(event["content"], end="", flush=True)
+            print("\n")
         except Exception as e:
             print(f"⚠️ Error: {e}\n")
 
 
 def main():
     """Main application loop."""
+    from telemetry import start_metrics_server, write_metrics
+
+    start_metrics_server()
     display_menu()
 
     try:
@@ -155,6 +166,8 @@ def main():
         print("\n\n🛑 Interrupted by user.")
 
     finally:
+        # Not next to the vector DB: cleanup() deletes VECTOR_DB_DIR at exit
+        write_metrics("metrics.prom")
         print("👋 Goodbye!\n")
 
 
@@ -0,0 +1,152 @@
+import base64
+import io
+import math
+import os
+import re
+
+MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", "3000"))
+MAX_PROMPT_IMAGES = int(os.getenv("MAX_PROMPT_IMAGES", "2"))
+IMAGE_TOKEN_BUDGET = int(os.getenv("IMAGE_TOKEN_BUDGET", "1600"))
+# Items that do not fit are truncated only if at least this many tokens remain
+MIN_TRUNCATED_TOKENS = 150
+# Share of a chunk's word shingles already in the context above which it is a duplicate
+DUPLICATE_THRESHOLD = 0.8
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            # Tokenizer family used by gpt-4o-mini
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def truncate_to_tokens(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:max_tokens])
+    return text[: max_tokens * 4]
+
+
+def estimate_image_tokens(b64):
+    """
+    Estimate OpenAI vision tokens for a high-detail image: 85 base tokens plus 170 per
+    512px tile after scaling to fit 2048x2048 and a 768px shortest side.
+    """
+    try:
+        from PIL import Image
+
+        width, height = Image.open(io.BytesIO(base64.b64decode(b64))).size
+    except Exception:
+        return 765  # cost of a typical 1024x1024 image
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def _shingles(text, n=5):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i : i + n]) for i in range(len(words) - n + 1)}
+
+
+def pack_context(
+    context,
+    max_tokens=MAX_CONTEXT_TOKENS,
+    max_images=MAX_PROMPT_IMAGES,
+    image_token_budget=IMAGE_TOKEN_BUDGET,
+):
+    """
+    Fit a RetrievedContext into a token budget.
+
+    Text and table chunks are taken in retrieval rank order; chunks that mostly repeat
+    content already packed are dropped, and the first chunk that no longer fits is
+    truncated (if enough budget remains) while later ones are dropped. Images have
+    their own count and token budget. Returns the packed chunks and images, the
+    tokens used and a list describing every dropped or truncated item.
+    """
+    candidates = sorted(
+        [(doc, doc.page_content) for doc in context["texts"]]
+        + [
+            (doc, doc.metadata.get("text_as_html", doc.page_content))
+            for doc in context["tables"]
+        ],
+        key=lambda item: item[0].metadata.get("rank", 0),
+    )
+
+    texts, dropped = [], []
+    seen_shingles = set()
+    used = 0
+
+    for doc, content in candidates:
+        source = doc.metadata.get("source")
+        modality = doc.metadata.get("modality", "text")
+
+        shingles = _shingles(doc.page_content)
+        overlap = len(shingles & seen_shingles) / len(shingles) if shingles else 0.0
+        if overlap >= DUPLICATE_THRESHOLD:
+            dropped.append(
+                {"modality": modality, "source": source, "reason": "duplicate"}
+            )
+            continue
+
+        tokens = count_tokens(content)
+        remaining = max_tokens - used
+        if tokens > remaining and modality == "table" and content != doc.page_content:
+            # Fall back from HTML to the (much shorter) plain table text
+            content = doc.page_content
+            tokens = count_tokens(content)
+
+        if tokens > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                dropped.append(
+                    {"modality": modality, "source": source, "reason": "budget"}
+                )
+                continue
+            content = truncate_to_tokens(content, remaining)
+            tokens = remaining
+            shingles = _shingles(content)
+            dropped.append(
+                {"modality": modality, "source": source, "reason": "truncated"}
+            )
+
+        texts.append(content)
+        seen_shingles |= shingles
+        used += tokens
+
+    images, image_tokens = [], 0
+    for b64 in context["images"]:
+        cost = estimate_image_tokens(b64)
+        if len(images) >= max_images or image_tokens + cost > image_token_budget:
+            dropped.append({"modality": "image", "source": None, "reason": "budget"})
+            continue
+        images.append(b64)
+        image_tokens += cost
+
+    return {
+        "texts": texts,
+        "images": images,
+        "text_tokens": used,
+        "image_tokens": image_tokens,
+        "dropped": dropped,
+    }
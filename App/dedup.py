@@ -0,0 +1,224 @@
+import base64
+import hashlib
+import html as html_lib
+import io
+import os
+import pickle
+import re
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from manifest import element_content
+
+# Set DEDUP=0 to summarize and embed every occurrence of repeated content
+DEDUP_ENABLED = os.getenv("DEDUP", "1") == "1"
+# Most differing bits (of 64) for two fingerprints to count as near-duplicates.
+# Tables only match exactly: tables that differ in one cell are different tables.
+MAX_DISTANCE = {
+    "text": int(os.getenv("TEXT_SIMHASH_DISTANCE", "2")),
+    "table": 0,
+    "image": int(os.getenv("IMAGE_DHASH_DISTANCE", "4")),
+}
+SHINGLE_SIZE = 3
+
+_TOKEN = re.compile(r"\w+")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+_TAG = re.compile(r"<[^>]+>")
+_BITS = np.arange(64, dtype=np.uint64)
+# 8 bands of 8 bits: fingerprints within 7 bits of each other share at least one band
+_BANDS = 8
+# Bump when fingerprints change so older index files are rebuilt from new ingests
+INDEX_VERSION = 2
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+
+
+def simhash(text):
+    """
+    64-bit SimHash of a text's word shingles (None for empty text).
+    """
+    tokens = _TOKEN.findall(text.lower())
+    if not tokens:
+        return None
+    n = max(len(tokens) - SHINGLE_SIZE + 1, 1)
+    shingles = {" ".join(tokens[i : i + SHINGLE_SIZE]) for i in range(n)}
+    hashes = np.array([_hash64(s) for s in shingles], dtype=np.uint64)
+    ones = ((hashes[:, None] >> _BITS) & np.uint64(1)).sum(axis=0)
+    return int(sum(1 << bit for bit in range(64) if 2 * ones[bit] > len(hashes)))
+
+
+def dhash(b64, size=8):
+    """
+    64-bit difference hash of a base64 image: survives re-encoding, resizing and
+    small edits (None if the image cannot be decoded).
+    """
+    try:
+        img = Image.open(io.BytesIO(base64.b64decode(b64)))
+        img = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    except Exception:
+        return None
+    pixels = np.asarray(img, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+
+def _table_text(element):
+    # Cell contents only: the HTML markup is the same for every table
+    html = getattr(getattr(element, "metadata", None), "text_as_html", None)
+    text = html or element_content(element)
+    return html_lib.unescape(_TAG.sub(" ", text))
+
+
+def fingerprint(modality, element):
+    """
+    (hash, numbers) for an element, or None. Texts use SimHash plus the exact
+    sequence of their numbers, so a chunk whose figures changed ("150 bar" to
+    "210 bar") never matches its old version; tables hash their normalized cell
+    text exactly; images use dHash.
+    """
+    if modality == "image":
+        fp = dhash(element)
+        return None if fp is None else (fp, None)
+    if modality == "table":
+        text = " ".join(_table_text(element).lower().split())
+        return (_hash64(text), None) if text else None
+    text = element_content(element)
+    fp = simhash(text)
+    return None if fp is None else (fp, _hash64(" ".join(_NUMBER.findall(text))))
+
+
+def _bands(fp):
+    return [(i, fp[0] >> (8 * i) & 0xFF) for i in range(_BANDS)]
+
+
+class NearDuplicateIndex:
+    """
+    Fingerprints of stored documents (see fingerprint) with their source file,
+    bucketed by 8-bit bands, so a lookup only compares against the documents sharing
+    a band instead of the whole corpus.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.fingerprints = {}  # doc_id -> (modality, fingerprint, source)
+        self._buckets = {}  # (modality, band, value) -> {doc_id}
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            if isinstance(state, dict) and state.get("version") == INDEX_VERSION:
+                self.add_many(
+                    (k, m, fp, source)
+                    for k, (m, fp, source) in state["fingerprints"].items()
+                )
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def find(self, modality, fp, exclude_source=None):
+        """
+        The doc_id of the closest near-duplicate of fp, or None. Documents of
+        exclude_source are skipped, so a re-ingested file never links to its own
+        earlier (possibly outdated) chunks.
+        """
+        if fp is None:
+            return None
+        limit = MAX_DISTANCE[modality]
+        best, best_distance = None, limit + 1
+        with self._lock:
+            for band in _bands(fp):
+                for doc_id in self._buckets.get((modality, *band), ()):
+                    _, other, source = self.fingerprints[doc_id]
+                    if other[1] != fp[1]:
+                        continue
+                    if exclude_source is not None and source == exclude_source:
+                        continue
+                    distance = (fp[0] ^ other[0]).bit_count()
+                    if distance < best_distance:
+                        best, best_distance = doc_id, distance
+        return best
+
+    def add_many(self, items):
+        """
+        Index (doc_id, modality, fingerprint, source) tuples; None fingerprints are
+        skipped.
+        """
+        with self._lock:
+            for doc_id, modality, fp, source in items:
+                self._remove(doc_id)
+                if fp is None:
+                    continue
+                self.fingerprints[doc_id] = (modality, fp, source)
+                self._dirty = True
+                for band in _bands(fp):
+                    self._buckets.setdefault((modality, *band), set()).add(doc_id)
+
+    def remove_many(self, doc_ids):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        entry = self.fingerprints.pop(doc_id, None)
+        if entry is None:
+            return
+        self._dirty = True
+        modality, fp, _ = entry
+        for band in _bands(fp):
+            bucket = self._buckets[(modality, *band)]
+            bucket.discard(doc_id)
+            if not bucket:
+                del self._buckets[(modality, *band)]
+
+    def save(self, min_interval=0.0):
+        """
+        Pickle the index if it changed, at most once per min_interval seconds.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            if time.monotonic() - self._saved_at < min_interval:
+                return
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    {"version": INDEX_VERSION, "fingerprints": self.fingerprints},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+
+def find_duplicates(elements, modality, index=None, source=None):
+    """
+    Split elements of one source file into canonical ones and near-duplicates,
+    either of an earlier element in the list or of another file's document in index.
+    Returns (keep, fingerprints, linked): indices of the canonical elements, their
+    fingerprints, and the doc_ids of stored documents that duplicates link to.
+    """
+    batch = NearDuplicateIndex()
+    keep, fingerprints, linked = [], [], []
+    for i, element in enumerate(elements):
+        fp = fingerprint(modality, element)
+        doc_id = None
+        if index is not None:
+            doc_id = index.find(modality, fp, exclude_source=source)
+        if doc_id is not None:
+            linked.append(doc_id)
+        elif batch.find(modality, fp) is None:
+            batch.add_many([(i, modality, fp, source)])
+            keep.append(i)
+            fingerprints.append(fp)
+    return keep, fingerprints, list(dict.fromkeys(linked))
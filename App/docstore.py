@@ -0,0 +1,81 @@
+import os
+import pickle
+import sqlite3
+import threading
+
+from langchain_core.stores import BaseStore
+
+
+class SQLiteDocStore(BaseStore):
+    """
+    Persistent docstore for MultiVectorRetriever backed by a single SQLite file.
+    Values are pickled on write and only read back when mget asks for their keys,
+    so large payloads (image base64, long chunks) never sit in RAM between queries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docstore (key TEXT PRIMARY KEY, value BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def mget(self, keys):
+        if not keys:
+            return []
+
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), 500):
+                batch = unique[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM docstore WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                found.update(rows)
+
+        return [pickle.loads(found[k]) if k in found else None for k in keys]
+
+    def mset(self, key_value_pairs):
+        rows = [
+            (k, pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL))
+            for k, v in key_value_pairs
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO docstore (key, value) VALUES (?, ?)", rows
+            )
+            self._conn.commit()
+
+    def mdelete(self, keys):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM docstore WHERE key = ?", [(k,) for k in keys]
+            )
+            self._conn.commit()
+
+    def yield_keys(self, prefix=None):
+        with self._lock:
+            if prefix is None:
+                rows = self._conn.execute("SELECT key FROM docstore").fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT key FROM docstore WHERE substr(key, 1, ?) = ?",
+                    (len(prefix), prefix),
+                ).fetchall()
+        for (key,) in rows:
+            yield key
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docstore").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,295 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from telemetry import increment, span
+
+EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+# "torch" (fp32 sentence-transformers) or "onnx-int8" (quantized ONNX Runtime on CPU)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite")
+# Document embeddings kept on disk (least recently used beyond this are evicted)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+# Query embeddings are only kept in memory, never written on the query path
+QUERY_CACHE_SIZE = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "1024"))
+
+# Dynamic int8 quantization target ("avx2", "avx512", "avx512_vnni" or "arm64")
+ONNX_QUANTIZATION = os.getenv("ONNX_QUANTIZATION", "avx2")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx_models/bge-small-en-v1.5")
+
+
+def _ensure_int8_onnx_model(model, model_dir=ONNX_MODEL_DIR):
+    """
+    Export the model to ONNX and quantize it to int8 once; later runs reuse the files.
+    Returns (local model dir, quantized file name).
+    """
+    file_name = f"onnx/model_qint8_{ONNX_QUANTIZATION}.onnx"
+    if not os.path.exists(os.path.join(model_dir, file_name)):
+        from sentence_transformers import (
+            SentenceTransformer,
+            export_dynamic_quantized_onnx_model,
+        )
+
+        print(f"⚙️ Exporting int8 ONNX model for {model} to {model_dir}...")
+        st_model = SentenceTransformer(model, backend="onnx", device="cpu")
+        st_model.save_pretrained(model_dir)
+        export_dynamic_quantized_onnx_model(st_model, ONNX_QUANTIZATION, model_dir)
+    return model_dir, file_name
+
+
+def create_base_embeddings(
+    backend=EMBEDDING_BACKEND, batch_size=EMBEDDING_BATCH_SIZE, model=EMBEDDING_MODEL
+):
+    """
+    Build the HuggingFace embedding model for the chosen CPU backend.
+    """
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    model_kwargs = {"device": "cpu"}
+    if backend == "onnx-int8":
+        model, file_name = _ensure_int8_onnx_model(model)
+        model_kwargs["backend"] = "onnx"
+        model_kwargs["model_kwargs"] = {"file_name": file_name}
+    elif backend != "torch":
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    return HuggingFaceEmbeddings(
+        model=model,
+        model_kwargs=model_kwargs,
+        # bge models are trained for cosine similarity on normalized vectors
+        encode_kwargs={"batch_size": batch_size, "normalize_embeddings": True},
+    )
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper with an on-disk cache keyed by model, backend and text hash.
+    Only texts missing from the cache are sent to the underlying model, in one batch.
+    The disk cache holds document embeddings with LRU eviction beyond max_entries;
+    queries are looked up there but only stored in a bounded in-memory LRU.
+    """
+
+    def __init__(
+        self,
+        base,
+        namespace,
+        path=EMBEDDING_CACHE_PATH,
+        max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+        query_cache_size=QUERY_CACHE_SIZE,
+    ):
+        self.base = base
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.query_cache_size = query_cache_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._queries = OrderedDict()  # key -> vector
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "accessed_at REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [
+            row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")
+        ]
+        if "accessed_at" not in columns:
+            # Caches written before eviction existed
+            self._conn.execute(
+                "ALTER TABLE embeddings ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0"
+            )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_accessed "
+            "ON embeddings(accessed_at)"
+        )
+        self._conn.commit()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys, touch=True):
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), 500):
+                batch = unique[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                found.update(
+                    (k, np.frombuffer(v, dtype=np.float32).tolist()) for k, v in rows
+                )
+            if found and touch:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET accessed_at = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _save(self, vectors):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, accessed_at) "
+                "VALUES (?, ?, ?)",
+                [
+                    (k, np.asarray(v, dtype=np.float32).tobytes(), now)
+                    for k, v in vectors.items()
+                ],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count > self.max_entries:
+            # Drop ~10% beyond the limit at once to amortize eviction cost
+            n = count - self.max_entries + self.max_entries // 10
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY accessed_at ASC LIMIT ?)",
+                (n,),
+            )
+
+    def embed_documents(self, texts):
+        keys = [self._key(t) for t in texts]
+        vectors = self._lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+
+        n_missing = sum(1 for k in keys if k in missing)
+        hits = len(keys) - n_missing
+        with self._lock:
+            self.hits += hits
+            self.misses += n_missing
+        increment("cache_lookups", hits, cache="embedding", result="hit")
+        increment("cache_lookups", n_missing, cache="embedding", result="miss")
+
+        if missing:
+            increment("embedded_texts", len(missing))
+            with span("embedding"):
+                fresh = self.base.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing, fresh))
+            self._save(new_vectors)
+            vectors.update(new_vectors)
+
+        return [list(vectors[k]) for k in keys]
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts):
+        """
+        Embed several queries with one model batch for the misses. Unlike
+        embed_documents nothing is written to disk: new vectors only go to the
+        in-memory query LRU.
+        """
+        keys = [self._key(t) for t in texts]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                if key in self._queries:
+                    self._queries.move_to_end(key)
+                    vectors[key] = self._queries[key]
+        # A query equal to a stored text reuses its vector
+        vectors.update(self._lookup([k for k in keys if k not in vectors], touch=False))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        n_missing = sum(1 for k in keys if k in missing)
+        with self._lock:
+            self.hits += len(keys) - n_missing
+            self.misses += n_missing
+        increment(
+            "cache_lookups",
+            len(keys) - n_missing,
+            cache="embedding_query",
+            result="hit",
+        )
+        increment("cache_lookups", n_missing, cache="embedding_query", result="miss")
+
+        if missing:
+            increment("embedded_texts", len(missing))
+            with span("embedding"):
+                fresh = self.base.embed_documents(list(missing.values()))
+            vectors.update((k, list(v)) for k, v in zip(missing, fresh))
+        with self._lock:
+            for key in keys:
+                self._queries[key] = vectors[key]
+                self._queries.move_to_end(key)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return [list(vectors[k]) for k in keys]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def create_embeddings(
+    backend=EMBEDDING_BACKEND,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    cache_path=EMBEDDING_CACHE_PATH,
+):
+    """
+    Embedding model used by the vector DB: the chosen backend behind the disk cache.
+    Pass cache_path=None to disable caching.
+    """
+    base = create_base_embeddings(backend=backend, batch_size=batch_size)
+    if cache_path is None:
+        return base
+    return CachedEmbeddings(
+        base, namespace=f"{EMBEDDING_MODEL}:{backend}", path=cache_path
+    )
+
+
+def compare_backends(texts, baseline="torch", candidate="onnx-int8"):
+    """
+    Measure the accuracy delta of a backend against a baseline on sample texts:
+    cosine similarity between their embeddings of the same text, and the share of
+    texts whose nearest neighbour (among the others) stays the same.
+    """
+    a = np.asarray(create_base_embeddings(baseline).embed_documents(texts))
+    b = np.asarray(create_base_embeddings(candidate).embed_documents(texts))
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+
+    cosine = np.sum(a * b, axis=1)
+    sim_a, sim_b = a @ a.T, b @ b.T
+    np.fill_diagonal(sim_a, -np.inf)
+    np.fill_diagonal(sim_b, -np.inf)
+    same_neighbour = np.mean(np.argmax(sim_a, axis=1) == np.argmax(sim_b, axis=1))
+
+    return {
+        "mean_cosine": float(np.mean(cosine)),
+        "min_cosine": float(np.min(cosine)),
+        "nearest_neighbour_agreement": float(same_neighbour),
+    }
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    # python embeddings.py samples.txt  (one sample text per non-empty line)
+    with open(sys.argv[1], encoding="utf-8") as f:
+        samples = [line.strip() for line in f if line.strip()]
+    print(json.dumps(compare_backends(samples), indent=2))
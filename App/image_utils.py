@@ -0,0 +1,163 @@
+import base64
+import io
+import os
+
+from PIL import Image
+
+from registry import get_or_create
+from summary_cache import SummaryCache, content_key
+
+MAX_IMAGE_DIMENSION = int(os.getenv("MAX_IMAGE_DIMENSION", "1024"))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", "150000"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG")  # "JPEG" or "WEBP"
+IMAGE_QUALITY = 80
+MIN_IMAGE_QUALITY = 40
+# Mean per-pixel channel spread below which an image is treated as line art/grayscale
+GRAYSCALE_CHROMA_THRESHOLD = 8
+
+# Bump whenever the normalization settings change so cached results are not reused
+NORMALIZE_VERSION = "v2"
+# Normalized images are cached in their own file: they are far larger than summaries
+# and would otherwise evict them and skew the summary cache's hit/miss counts
+NORMALIZED_IMAGE_CACHE_PATH = os.getenv(
+    "NORMALIZED_IMAGE_CACHE_PATH", "normalized_images.sqlite"
+)
+NORMALIZED_IMAGE_CACHE_MAX_BYTES = int(
+    os.getenv("NORMALIZED_IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+
+_MIME_BY_MAGIC = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+]
+
+
+def image_mime_type(b64):
+    """
+    Detect the MIME type of a base64 image from its first bytes.
+    """
+    try:
+        head = base64.b64decode(b64[:16])
+    except Exception:
+        return "image/jpeg"
+    for magic, mime in _MIME_BY_MAGIC:
+        if head.startswith(magic):
+            return mime
+    return "image/jpeg"
+
+
+def image_data_url(b64):
+    return f"data:{image_mime_type(b64)};base64,{b64}"
+
+
+def _is_grayscale(img):
+    small = img.convert("RGB")
+    small.thumbnail((64, 64))
+    pixels = list(small.getdata())
+    chroma = sum(max(p) - min(p) for p in pixels) / max(len(pixels), 1)
+    return chroma < GRAYSCALE_CHROMA_THRESHOLD
+
+
+def _encode(img, image_format, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format, quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def normalize_image(
+    data,
+    max_dimension=MAX_IMAGE_DIMENSION,
+    max_bytes=MAX_IMAGE_BYTES,
+    image_format=IMAGE_FORMAT,
+    quality=IMAGE_QUALITY,
+):
+    """
+    Resize an image to max_dimension, convert line art to grayscale and re-encode it,
+    lowering quality (then size) until it fits max_bytes. Returns the original bytes
+    when it fits max_dimension and re-encoding would not make it smaller; an oversized
+    image is always downscaled, since vision-token cost follows pixels, not bytes.
+    """
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    oversized = max(img.size) > max_dimension
+
+    if img.mode in ("RGBA", "LA", "P"):
+        # JPEG has no alpha channel: flatten onto white like a PDF page
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        img = background
+
+    img = img.convert("L") if _is_grayscale(img) else img.convert("RGB")
+    img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    encoded = _encode(img, image_format, quality)
+    while len(encoded) > max_bytes and quality > MIN_IMAGE_QUALITY:
+        quality -= 10
+        encoded = _encode(img, image_format, quality)
+    while len(encoded) > max_bytes and min(img.size) > 64:
+        img = img.resize((int(img.width * 0.75), int(img.height * 0.75)), Image.LANCZOS)
+        encoded = _encode(img, image_format, quality)
+
+    return encoded if oversized or len(encoded) < len(data) else data
+
+
+def get_normalized_image_cache():
+    return get_or_create(
+        "normalized_image_cache",
+        lambda: SummaryCache(
+            NORMALIZED_IMAGE_CACHE_PATH, max_bytes=NORMALIZED_IMAGE_CACHE_MAX_BYTES
+        ),
+    )
+
+
+def normalize_images(images_b64, cache=None):
+    """
+    Normalize base64 images for the vision models. Results are cached by original
+    content so re-ingesting the same images costs only a hash.
+    """
+    cache = cache or get_normalized_image_cache()
+    settings = (
+        f"{NORMALIZE_VERSION}:{MAX_IMAGE_DIMENSION}:{MAX_IMAGE_BYTES}:{IMAGE_FORMAT}"
+    )
+
+    originals = []
+    for b64 in images_b64:
+        try:
+            originals.append(base64.b64decode(b64))
+        except Exception:
+            originals.append(None)
+
+    keys = [
+        content_key(data, "image-normalize", settings) if data else None
+        for data in originals
+    ]
+    cached = cache.get_many([k for k in keys if k])
+
+    normalized, new_entries = [], {}
+    saved_bytes = 0
+    for b64, data, key in zip(images_b64, originals, keys):
+        if key in cached:
+            # An empty entry means the original was already optimal
+            normalized.append(cached[key] or b64)
+            continue
+        if data is None:
+            normalized.append(b64)
+            continue
+        try:
+            result = base64.b64encode(normalize_image(data)).decode("ascii")
+        except Exception as e:
+            print(f"⚠️ Could not normalize image, keeping original: {e}")
+            result = b64
+        saved_bytes += len(b64) - len(result)
+        normalized.append(result)
+        new_entries[key] = "" if result == b64 else result
+
+    cache.set_many(new_entries)
+    if new_entries:
+        print(
+            f"🖼️ Normalized {len(new_entries)} images, saved {saved_bytes / 1024:.0f} KB."
+        )
+    return normalized
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from Ingestion_chain import IngestionCancelled, ingestion_chain
+from registry import get_or_create
+
+# Files ingested concurrently across all sessions
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+STAGES = ("queued", "partition", "summarize", "commit", "done")
+
+
+class IngestionJob:
+    """
+    One file being ingested in the background, with its current stage and outcome.
+    status is "queued", "running", "done", "failed" or "cancelled".
+    """
+
+    def __init__(self, file_path, retriever=None, owner=None, open_retriever=None):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.file_name = os.path.basename(file_path)
+        self.retriever = retriever
+        self.open_retriever = open_retriever
+        self.owner = owner
+        self.status = "queued"
+        self.stage = "queued"
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "file_name": self.file_name,
+            "owner": self.owner,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": STAGES.index(self.stage) / (len(STAGES) - 1),
+            "error": self.error,
+            "seconds": (self.finished_at or time.time()) - self.submitted_at,
+        }
+
+
+class IngestionJobQueue:
+    """
+    Background ingestion: submitted files are processed by a thread pool, several at
+    a time, while callers poll jobs() for per-file stage progress. Each file is
+    queryable as soon as its job is done. Queued jobs can be cancelled outright;
+    running jobs stop before their next stage.
+    """
+
+    def __init__(self, max_workers=INGEST_WORKERS):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingest"
+        )
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, file_path, retriever=None, owner=None, open_retriever=None):
+        """
+        Queue a PDF for ingestion into retriever. Returns the job id.
+        Instead of a retriever, open_retriever can be a zero-argument callable
+        returning a context manager that yields one, entered only when the job starts
+        (e.g. functools.partial(tenants.pinned, tenant_id)).
+        """
+        if (retriever is None) == (open_retriever is None):
+            raise ValueError("Pass exactly one of retriever and open_retriever.")
+        job = IngestionJob(file_path, retriever, owner, open_retriever)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job)
+        return job.id
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return
+
+        def progress(file_path, stage):
+            job.stage = stage
+
+        job.status = "running"
+        opened = (
+            job.open_retriever() if job.open_retriever else nullcontext(job.retriever)
+        )
+        try:
+            with opened as retriever:
+                ingestion_chain(
+                    job.file_path,
+                    retriever,
+                    progress=progress,
+                    cancel_event=job.cancel_event,
+                )
+            job.stage = "done"
+            job.status = "done"
+        except IngestionCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            # Finished jobs only keep their status, not the retriever
+            job.retriever = job.open_retriever = None
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        return True
+
+    def jobs(self, owner=None):
+        """
+        Snapshots of the jobs (optionally of one owner), oldest first.
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [j.to_dict() for j in jobs if owner is None or j.owner == owner]
+
+    def clear_finished(self, owner=None):
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished and (owner is None or job.owner == owner):
+                    del self._jobs[job_id]
+
+    def shutdown(self, cancel=True):
+        if cancel:
+            with self._lock:
+                jobs = list(self._jobs.values())
+            for job in jobs:
+                job.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=cancel)
+
+
+def get_ingestion_queue():
+    """
+    Process-wide ingestion queue shared by all sessions.
+    """
+    return get_or_create("ingestion_queue", IngestionJobQueue)
@@ -0,0 +1,166 @@
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+import time
+from collections import Counter
+
+# Keep identifiers such as "X-200", "v1.5" or "ISO_9001" as single tokens
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._\-/][a-z0-9]+)*")
+# Too common to rank anything, yet their postings list nearly every document
+STOPWORDS = frozenset("""
+    a about above after again against all am an and any are as at be because been
+    before being below between both but by can could did do does doing down during each
+    few for from further had has have having he her here hers herself him himself his
+    how i if in into is it its itself just me more most my myself nor of off on once
+    only or other our ours ourselves out over own same she should so some such than
+    that the their theirs them themselves then there these they this those through to
+    too under until up very was we were what when where which while who whom why will
+    with would you your yours yourself yourselves
+    """.split())
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Incrementally updatable BM25 index over an inverted index of term frequencies.
+    Adding or removing a document only touches that document's postings, and a query
+    only scores the postings of its own terms. Stopwords are not indexed.
+    """
+
+    def __init__(self, path=None, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self.postings = {}  # term -> {doc_id: term frequency}
+        self.doc_lengths = {}  # doc_id -> number of tokens
+        self.doc_terms = {}  # doc_id -> distinct terms, for cheap removal
+        self.total_length = 0
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            self.postings = state["postings"]
+            self.doc_lengths = state["doc_lengths"]
+            self.doc_terms = state["doc_terms"]
+            self.total_length = sum(self.doc_lengths.values())
+            if not STOPWORDS.isdisjoint(self.postings):
+                self._drop_stopwords()
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def _drop_stopwords(self):
+        # Index saved before stopwords were dropped: remove their postings and
+        # recount document lengths from what is left, as a fresh index would have
+        for term in STOPWORDS.intersection(self.postings):
+            del self.postings[term]
+        for doc_id, terms in self.doc_terms.items():
+            self.doc_terms[doc_id] = [t for t in terms if t not in STOPWORDS]
+        self.doc_lengths = dict.fromkeys(self.doc_lengths, 0)
+        for docs in self.postings.values():
+            for doc_id, tf in docs.items():
+                self.doc_lengths[doc_id] += tf
+        self.total_length = sum(self.doc_lengths.values())
+        self._dirty = True
+
+    def add_many(self, items):
+        """
+        Index (doc_id, text) pairs, replacing any previous text for the same doc_id.
+        """
+        with self._lock:
+            for doc_id, text in items:
+                self._remove(doc_id)
+                tokens = tokenize(text)
+                counts = Counter(tokens)
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[doc_id] = tf
+                self.doc_terms[doc_id] = list(counts)
+                self.doc_lengths[doc_id] = len(tokens)
+                self.total_length += len(tokens)
+                self._dirty = True
+
+    def remove_many(self, doc_ids):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        length = self.doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        self._dirty = True
+        for term in self.doc_terms.pop(doc_id, []):
+            docs = self.postings[term]
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+
+    def search(self, query, k=10):
+        """
+        Return the top-k (doc_id, score) pairs for a query.
+        """
+        with self._lock:
+            n_docs = len(self.doc_lengths)
+            if n_docs == 0:
+                return []
+            avg_length = self.total_length / n_docs
+
+            scores = {}
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    norm = self.k1 * (
+                        1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length
+                    )
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (
+                        self.k1 + 1
+                    ) / (tf + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, min_interval=0.0):
+        """
+        Pickle the index if it changed, at most once per min_interval seconds.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            if time.monotonic() - self._saved_at < min_interval:
+                return
+            state = {
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths,
+                "doc_terms": self.doc_terms,
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several ranked lists of IDs into one, scoring each ID by sum(1 / (k + rank)).
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
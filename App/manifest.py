@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+# Namespace for content-derived chunk IDs (uuid5), so IDs stay UUID-shaped
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c4a52-3c1e-4d0b-9a57-2f8e4b1d7c90")
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """
+    Hash a file's contents in blocks.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def element_content(element):
+    """
+    Return the text used to identify an element (chunk, table or base64 image).
+    """
+    if isinstance(element, str):
+        return element
+    if hasattr(element, "text"):
+        return element.text
+    return str(element)
+
+
+def make_chunk_id(source, modality, content, tenant_id=None):
+    """
+    Deterministic, content-derived chunk ID: the same chunk of the same source always
+    gets the same ID across runs. With a tenant_id, tenants sharing a store never
+    collide on the same document.
+    """
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    name = f"{source}\0{modality}\0{digest}"
+    if tenant_id:
+        name = f"{tenant_id}\0{name}"
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, name))
+
+
+# Per-path locks: several manifests for the same file may be open at once
+_save_locks = {}
+_save_locks_lock = threading.Lock()
+
+
+def _save_lock(path):
+    with _save_locks_lock:
+        return _save_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class IngestionManifest:
+    """
+    JSON manifest of ingested source files: content hash and the chunk IDs each
+    file contributed to the vector DB and docstore.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = self._load()
+        # Sources recorded/removed through this instance (None = removed)
+        self._changes = {}
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self):
+        """
+        Write this instance's changes on top of the current file, so concurrent
+        ingestion jobs sharing a manifest do not overwrite each other's entries.
+        """
+        with _save_lock(self.path), self._lock:
+            entries = self._load()
+            for source, entry in self._changes.items():
+                if entry is None:
+                    entries.pop(source, None)
+                else:
+                    entries[source] = entry
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+            self.entries = entries
+            self._changes.clear()
+
+    def is_unchanged(self, file_path, sha256):
+        entry = self.entries.get(os.path.abspath(file_path))
+        return entry is not None and entry["sha256"] == sha256
+
+    def doc_ids(self, file_path):
+        entry = self.entries.get(os.path.abspath(file_path))
+        return list(entry["doc_ids"]) if entry else []
+
+    def record(self, file_path, sha256, doc_ids):
+        source = os.path.abspath(file_path)
+        entry = {"sha256": sha256, "doc_ids": list(doc_ids)}
+        with self._lock:
+            self.entries[source] = entry
+            self._changes[source] = entry
+
+    def remove(self, file_path):
+        source = os.path.abspath(file_path)
+        with self._lock:
+            self.entries.pop(source, None)
+            self._changes[source] = None
+
+    def missing_sources(self, directory_path, present_files):
+        """
+        Sources recorded under directory_path that no longer exist in present_files.
+        """
+        directory = os.path.join(os.path.abspath(directory_path), "")
+        present = {os.path.abspath(p) for p in present_files}
+        return [
+            source
+            for source in self.entries
+            if source.startswith(directory) and source not in present
+        ]
+
+    def unreferenced(self, doc_ids, exclude_source=None):
+        """
+        Filter doc_ids down to those no other recorded source still uses.
+        """
+        exclude = os.path.abspath(exclude_source) if exclude_source else None
+        in_use = set()
+        for source, entry in self.entries.items():
+            if source != exclude:
+                in_use.update(entry["doc_ids"])
+        return [i for i in doc_ids if i not in in_use]
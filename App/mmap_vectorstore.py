@@ -0,0 +1,631 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+# "float16" (2 bytes per dimension) or "int8" (1 byte plus a per-row scale)
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float16")
+# Partition into IVF lists once this many vectors are stored (0 disables IVF)
+IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS", "50000"))
+# Lists scanned per query when IVF is built
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+# Rows converted to float32 and scored at a time (bounds the temporary memory)
+SCAN_BLOCK_ROWS = 65536
+
+_DTYPES = {"float16": np.float16, "int8": np.int8}
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _quantize(vectors, dtype):
+    """
+    Returns (rows in dtype, per-row scales or None).
+    """
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        rows = np.round(vectors / scales[:, None]).astype(np.int8)
+        return rows, scales.astype(np.float32)
+    return vectors.astype(np.float16), None
+
+
+def _top_k(scores, k):
+    if k < len(scores):
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+    idx = idx[np.argsort(-scores[idx], kind="stable")]
+    return idx[np.isfinite(scores[idx])]
+
+
+def _matches(metadata, where):
+    """
+    Chroma-style metadata filter: {"key": value}, {"key": {"$in": [...]}},
+    {"$and": [...]}, {"$or": [...]} with $eq, $ne, $in, $nin, $gt, $gte, $lt, $lte.
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(metadata, c) for c in condition):
+                return False
+        else:
+            value = metadata.get(key)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, operand in condition.items():
+                if op == "$eq":
+                    ok = value == operand
+                elif op == "$ne":
+                    ok = value != operand
+                elif op == "$in":
+                    ok = value in operand
+                elif op == "$nin":
+                    ok = value not in operand
+                elif op in ("$gt", "$gte", "$lt", "$lte"):
+                    if value is None:
+                        return False
+                    ok = {
+                        "$gt": value > operand,
+                        "$gte": value >= operand,
+                        "$lt": value < operand,
+                        "$lte": value <= operand,
+                    }[op]
+                else:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+                if not ok:
+                    return False
+    return True
+
+
+class _Snapshot:
+    """
+    Read-only view of the store at one point: the memory-mapped matrix plus the
+    per-row state loaded from SQLite. Searches run on a snapshot without the lock.
+    """
+
+    def __init__(self, matrix, ids, metadatas, scales, live, lists, centroids):
+        self.matrix = matrix
+        self.ids = ids
+        self.metadatas = metadatas
+        self.scales = scales
+        self.live = live
+        self.centroids = centroids
+        self._masks = {}
+        if centroids is not None:
+            # Rows grouped by IVF list; rows without a list (-1) come first
+            self.order = np.argsort(lists, kind="stable")
+            self.bounds = np.searchsorted(
+                lists[self.order], np.arange(-1, len(centroids) + 1)
+            )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def allowed(self, where):
+        if not where:
+            return self.live
+        key = json.dumps(where, sort_keys=True, default=str)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self.live.copy()
+            for row in np.flatnonzero(mask):
+                mask[row] = _matches(self.metadatas[row], where)
+            self._masks[key] = mask
+        return mask
+
+    def vectors(self, rows):
+        block = np.asarray(self.matrix[rows], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[rows][:, None]
+        return block
+
+    def scores(self, rows, queries):
+        """
+        Similarities of rows (an index array, or None for all rows) against queries
+        (dim x m), scored block by block. Returns (len(rows) x m).
+        """
+        n = len(self) if rows is None else len(rows)
+        out = np.empty((n, queries.shape[1]), dtype=np.float32)
+        for start in range(0, n, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, n)
+            index = slice(start, end) if rows is None else rows[start:end]
+            out[start:end] = self.vectors(index) @ queries
+        return out
+
+    def ivf_candidates(self, query, nprobe):
+        probe = np.argsort(-(self.centroids @ query))[:nprobe]
+        spans = [(self.bounds[0], self.bounds[1])]
+        spans += [(self.bounds[j + 1], self.bounds[j + 2]) for j in probe]
+        return np.concatenate([self.order[a:b] for a, b in spans])
+
+
+class MemmapVectorStore(VectorStore):
+    """
+    Flat vector store with no server or HNSW graph: normalized embeddings live in one
+    append-only float16 or int8 matrix that is memory-mapped read-only (so processes
+    share its pages), and ids, summaries and metadata live in a small SQLite file.
+
+    Search is a vectorized brute-force cosine top-k, optionally restricted to the
+    nearest IVF lists once the store grows past IVF_MIN_VECTORS. Metadata filters
+    take the same form as Chroma's. Deletes are tombstones until compact().
+    """
+
+    def __init__(
+        self,
+        persist_directory,
+        embedding_function,
+        dtype=VECTOR_DTYPE,
+        ivf_min_vectors=IVF_MIN_VECTORS,
+        nprobe=IVF_NPROBE,
+    ):
+        if dtype not in _DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        os.makedirs(persist_directory, exist_ok=True)
+        self._persist_directory = persist_directory
+        self._embedding = embedding_function
+        self.ivf_min_vectors = ivf_min_vectors
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._data_version = None
+
+        self._conn = sqlite3.connect(
+            os.path.join(persist_directory, "vectors.sqlite"), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, "
+            "id TEXT NOT NULL, document TEXT, metadata TEXT, scale REAL, "
+            "ivf_list INTEGER NOT NULL DEFAULT -1, deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS rows_id ON rows (id)")
+        self._conn.execute(
+            "INSERT OR IGNORE INTO info (key, value) VALUES ('dtype', ?), "
+            "('generation', 0)",
+            (dtype,),
+        )
+        self._conn.commit()
+        self.dtype = self._info("dtype")
+        if self.dtype != dtype:
+            print(f"⚠️ Vector store holds {self.dtype} vectors; ignoring {dtype}.")
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # ----- storage -----
+    def _info(self, key, default=None):
+        row = self._conn.execute(
+            "SELECT value FROM info WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else default
+
+    def _matrix_path(self, generation):
+        return os.path.join(self._persist_directory, f"vectors.{generation}.bin")
+
+    def _load(self):
+        """
+        Current snapshot, reloaded when this or another process committed changes.
+        """
+        with self._lock:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._snapshot is not None and version == self._data_version:
+                return self._snapshot
+
+            rows = self._conn.execute(
+                "SELECT id, metadata, scale, ivf_list, deleted FROM rows ORDER BY row"
+            ).fetchall()
+            dim = self._info("dim")
+            n = len(rows)
+            matrix = None
+            if n:
+                matrix = np.memmap(
+                    self._matrix_path(self._info("generation")),
+                    dtype=_DTYPES[self.dtype],
+                    mode="r",
+                    shape=(n, dim),
+                )
+            live = np.array([not r[4] for r in rows], dtype=bool)
+            centroids = self._info("ivf_centroids")
+            if centroids is not None:
+                centroids = np.frombuffer(centroids, dtype=np.float32).reshape(-1, dim)
+            self._snapshot = _Snapshot(
+                matrix,
+                [r[0] for r in rows],
+                [json.loads(r[1]) if live[i] else None for i, r in enumerate(rows)],
+                (
+                    np.array([r[2] for r in rows], dtype=np.float32)
+                    if self.dtype == "int8"
+                    else None
+                ),
+                live,
+                np.array([r[3] for r in rows], dtype=np.int64),
+                centroids,
+            )
+            self._data_version = version
+            return self._snapshot
+
+    def _invalidate(self):
+        # Our own commits do not change data_version, so drop the snapshot directly
+        self._snapshot = None
+
+    def add_vectors(self, vectors, texts, metadatas=None, ids=None):
+        """
+        Append precomputed embeddings. Existing ids are replaced (the old rows become
+        tombstones). Returns the ids.
+        """
+        texts = list(texts)
+        ids = [str(i) for i in ids] if ids else [uuid.uuid4().hex for _ in texts]
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        if not texts:
+            return []
+
+        # The last occurrence of a repeated id wins
+        last = {doc_id: i for i, doc_id in enumerate(ids)}
+        keep = [i for i, doc_id in enumerate(ids) if last[doc_id] == i]
+        vectors = _normalize([vectors[i] for i in keep])
+        quantized, scales = _quantize(vectors, self.dtype)
+
+        with self._lock:
+            # Also serializes appends from other processes sharing the store
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._append(vectors, quantized, scales, texts, metadatas, ids, keep)
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+            self._invalidate()
+
+            live = int(self._load().live.sum())
+            built_at = self._info("ivf_built_at", 0)
+            if self.ivf_min_vectors and live >= max(self.ivf_min_vectors, 2 * built_at):
+                self.build_ivf()
+        return ids
+
+    def _append(self, vectors, quantized, scales, texts, metadatas, ids, keep):
+        dim = self._info("dim")
+        if dim is None:
+            dim = vectors.shape[1]
+            self._conn.execute("INSERT INTO info VALUES ('dim', ?)", (dim,))
+        elif vectors.shape[1] != dim:
+            raise ValueError(
+                f"Embedding size {vectors.shape[1]} does not match the store "
+                f"({dim}); re-ingest after changing the embedding model."
+            )
+
+        snapshot = self._load()
+        n = len(snapshot)
+        lists = [-1] * len(keep)
+        if snapshot.centroids is not None:
+            lists = np.argmax(vectors @ snapshot.centroids.T, axis=1).tolist()
+
+        # Rows past n are a torn tail from an interrupted append
+        path = self._matrix_path(self._info("generation"))
+        with open(path, "ab") as f:
+            f.truncate(n * dim * quantized.itemsize)
+            f.write(quantized.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        kept_ids = [ids[i] for i in keep]
+        self._conn.executemany(
+            "UPDATE rows SET deleted = 1 WHERE id = ? AND deleted = 0",
+            [(doc_id,) for doc_id in kept_ids],
+        )
+        self._conn.executemany(
+            "INSERT INTO rows (row, id, document, metadata, scale, ivf_list) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    n + j,
+                    ids[i],
+                    texts[i],
+                    json.dumps(metadatas[i] or {}),
+                    None if scales is None else float(scales[j]),
+                    lists[j],
+                )
+                for j, i in enumerate(keep)
+            ],
+        )
+
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        texts = list(texts)
+        vectors = self._embedding.embed_documents(texts) if texts else []
+        return self.add_vectors(vectors, texts, metadatas, ids)
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE rows SET deleted = 1 WHERE id = ? AND deleted = 0",
+                [(str(doc_id),) for doc_id in ids],
+            )
+            self._conn.commit()
+            self._invalidate()
+            snapshot = self._load()
+            # Reclaim space once tombstones outnumber live rows
+            if len(snapshot) - snapshot.live.sum() > max(snapshot.live.sum(), 1000):
+                self.compact()
+        return True
+
+    def compact(self):
+        """
+        Rewrite the matrix without deleted rows (into a new generation file, so
+        readers that still map the old one are unaffected).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                generation, n = self._rewrite()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+            self._invalidate()
+            self._remove_stale_generations(generation)
+        print(f"🧹 Compacted vector store to {n} rows.")
+
+    def _rewrite(self):
+        snapshot = self._load()
+        generation = self._info("generation") + 1
+        keep = np.flatnonzero(snapshot.live)
+        with open(self._matrix_path(generation), "wb") as f:
+            for start in range(0, len(keep), SCAN_BLOCK_ROWS):
+                rows = keep[start : start + SCAN_BLOCK_ROWS]
+                f.write(np.asarray(snapshot.matrix[rows]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        rows = self._conn.execute(
+            "SELECT id, document, metadata, scale, ivf_list FROM rows "
+            "WHERE deleted = 0 ORDER BY row"
+        ).fetchall()
+        self._conn.execute("DELETE FROM rows")
+        self._conn.executemany(
+            "INSERT INTO rows (row, id, document, metadata, scale, ivf_list) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(i, *row) for i, row in enumerate(rows)],
+        )
+        self._conn.execute(
+            "UPDATE info SET value = ? WHERE key = 'generation'", (generation,)
+        )
+        return generation, len(rows)
+
+    def _remove_stale_generations(self, generation):
+        current = self._matrix_path(generation)
+        for path in glob.glob(os.path.join(self._persist_directory, "vectors.*.bin")):
+            if path != current:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Still mapped by a reader on a platform that forbids removal
+                    pass
+
+    def build_ivf(self, n_lists=None, iterations=10, seed=0):
+        """
+        Partition the vectors into n_lists IVF lists (spherical k-means on a sample),
+        so queries only scan the IVF_NPROBE nearest lists.
+        """
+        with self._lock:
+            snapshot = self._load()
+            live = np.flatnonzero(snapshot.live)
+            n_lists = n_lists or max(int(np.sqrt(len(live))), 1)
+            rng = np.random.default_rng(seed)
+            sample = rng.choice(live, min(len(live), 64 * n_lists), replace=False)
+            sample_vectors = snapshot.vectors(np.sort(sample))
+            centroids = sample_vectors[
+                rng.choice(len(sample_vectors), n_lists, replace=False)
+            ]
+            for _ in range(iterations):
+                assign = np.argmax(sample_vectors @ centroids.T, axis=1)
+                for j in range(n_lists):
+                    members = sample_vectors[assign == j]
+                    if len(members):
+                        centroids[j] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+
+            lists = np.full(len(snapshot), -1, dtype=np.int64)
+            for start in range(0, len(live), SCAN_BLOCK_ROWS):
+                rows = live[start : start + SCAN_BLOCK_ROWS]
+                scores = snapshot.scores(rows, centroids.T)
+                lists[rows] = np.argmax(scores, axis=1)
+
+            self._conn.executemany(
+                "UPDATE rows SET ivf_list = ? WHERE row = ?",
+                [(int(lists[row]), int(row)) for row in live],
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO info VALUES ('ivf_centroids', ?), "
+                "('ivf_built_at', ?)",
+                (centroids.astype(np.float32).tobytes(), len(live)),
+            )
+            self._conn.commit()
+            self._invalidate()
+        print(f"🗂️ Built IVF index with {n_lists} lists over {len(live)} vectors.")
+
+    # ----- search -----
+    def _search(self, snapshot, query, k, where):
+        """
+        (rows, scores) of the top k allowed rows for one normalized query vector.
+        """
+        allowed = snapshot.allowed(where)
+        n_allowed = int(allowed.sum())
+        if n_allowed == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        rows = None
+        if snapshot.centroids is not None and n_allowed > len(
+            snapshot
+        ) * self.nprobe / len(snapshot.centroids):
+            # More rows pass the filter than the probed lists hold on average
+            rows = snapshot.ivf_candidates(query, self.nprobe)
+            rows = rows[allowed[rows]]
+            if len(rows) < k:
+                rows = None
+        if rows is None and n_allowed < len(snapshot) // 2:
+            # Few rows pass the filter: score only those
+            rows = np.flatnonzero(allowed)
+
+        scores = snapshot.scores(rows, query[:, None])[:, 0]
+        if rows is None:
+            scores[~allowed] = -np.inf
+            rows = np.arange(len(snapshot))
+        top = _top_k(scores, k)
+        return rows[top], scores[top]
+
+    def _documents(self, snapshot, rows):
+        if len(rows) == 0:
+            return []
+        # Looked up by id: row numbers change when another thread compacts
+        ids = [snapshot.ids[row] for row in rows]
+        with self._lock:
+            placeholders = ",".join("?" * len(ids))
+            texts = dict(
+                self._conn.execute(
+                    f"SELECT id, document FROM rows WHERE deleted = 0 "
+                    f"AND id IN ({placeholders})",
+                    ids,
+                ).fetchall()
+            )
+        return [
+            Document(
+                id=doc_id,
+                page_content=texts.get(doc_id) or "",
+                metadata=dict(snapshot.metadatas[row] or {}),
+            )
+            for doc_id, row in zip(ids, rows)
+        ]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None):
+        snapshot = self._load()
+        if not len(snapshot):
+            return []
+        query = _normalize([embedding])[0]
+        rows, scores = self._search(snapshot, query, k, filter)
+        return list(zip(self._documents(snapshot, rows), scores.tolist()))
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k, filter
+            )
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        embedding = self._embedding.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_by_vectors(self, embeddings, k=4, filter=None):
+        """
+        Top k documents for many query vectors; without IVF all queries are scored
+        in one matrix product. Returns one list per query.
+        """
+        snapshot = self._load()
+        if not len(snapshot):
+            return [[] for _ in embeddings]
+        queries = _normalize(embeddings)
+        if snapshot.centroids is not None:
+            results = [self._search(snapshot, q, k, filter)[0] for q in queries]
+        else:
+            allowed = snapshot.allowed(filter)
+            rows = None if allowed.all() else np.flatnonzero(allowed)
+            scores = snapshot.scores(rows, queries.T)
+            if rows is None:
+                rows = np.arange(len(snapshot))
+            results = [rows[_top_k(scores[:, j], k)] for j in range(len(queries))]
+        return [self._documents(snapshot, rows) for rows in results]
+
+    def max_marginal_relevance_search_by_vector(
+        self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs
+    ):
+        snapshot = self._load()
+        if not len(snapshot):
+            return []
+        query = _normalize([embedding])[0]
+        rows, _ = self._search(snapshot, query, fetch_k, filter)
+        if len(rows) == 0:
+            return []
+        selected = maximal_marginal_relevance(
+            query, snapshot.vectors(rows), k=k, lambda_mult=lambda_mult
+        )
+        return self._documents(snapshot, rows[selected])
+
+    def max_marginal_relevance_search(
+        self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs
+    ):
+        embedding = self._embedding.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(
+            embedding, k, fetch_k, lambda_mult, filter
+        )
+
+    def _select_relevance_score_fn(self):
+        # Scores are cosine similarities in [-1, 1]
+        return lambda score: (score + 1) / 2
+
+    # ----- lookup -----
+    def get_by_ids(self, ids):
+        snapshot = self._load()
+        wanted = set(ids)
+        rows = [r for r in np.flatnonzero(snapshot.live) if snapshot.ids[r] in wanted]
+        return self._documents(snapshot, rows)
+
+    def get(self, ids=None, where=None, include=None, **kwargs):
+        """
+        Chroma-compatible lookup by ids and/or metadata filter.
+        """
+        snapshot = self._load()
+        mask = snapshot.allowed(where)
+        if ids is not None:
+            wanted = set(ids)
+            mask = mask & np.array([i in wanted for i in snapshot.ids], dtype=bool)
+        rows = np.flatnonzero(mask)
+        result = {"ids": [snapshot.ids[r] for r in rows]}
+        include = include or ["metadatas", "documents"]
+        if "metadatas" in include:
+            result["metadatas"] = [dict(snapshot.metadatas[r]) for r in rows]
+        if "documents" in include:
+            result["documents"] = [
+                d.page_content for d in self._documents(snapshot, rows)
+            ]
+        return result
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts,
+        embedding,
+        metadatas=None,
+        *,
+        ids=None,
+        persist_directory="./vector_store",
+        **kwargs,
+    ):
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
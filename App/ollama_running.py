@@ -1,44 +1,216 @@
-import subprocess
+import json
+import os
 import platform
+import shutil
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
 
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+if "://" not in OLLAMA_HOST:
+    OLLAMA_HOST = f"http://{OLLAMA_HOST}"
+OLLAMA_READY_TIMEOUT = float(os.getenv("OLLAMA_READY_TIMEOUT", "60"))
+# How long a probe result is trusted before the server is asked again
+OLLAMA_HEALTH_TTL = float(os.getenv("OLLAMA_HEALTH_TTL", "10"))
+# How long Ollama keeps a model in memory after its last request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_WARMUP_TIMEOUT = float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "300"))
 
-def ensure_ollama_running():
-    try:
-        # Check if Ollama is running
-        result = subprocess.run(
-            ["ollama", "list"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
-        if result.returncode == 0:
-            print("✅ Ollama is running.")
-            return
-    except FileNotFoundError:
-        print("❌ Ollama not found in PATH.")
-        return
-
-    # If it reaches here, Ollama isn't running
-    print("⚠️ Ollama not running. Starting it now...")
-
-    system = platform.system()
-    if system == "Darwin":  # macOS
-        subprocess.Popen(["open", "-a", "Ollama"])
-    elif system == "Windows":
-        subprocess.Popen(
-            ["cmd", "/c", "start", "ollama"],
-            shell=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+
+class OllamaServer:
+    """
+    Manager for the local Ollama server: probes the HTTP API (with a cached health
+    status), starts the server if needed, waits for readiness and preloads models so
+    the first summarization request does not pay the model load time.
+    """
+
+    def __init__(self, host=OLLAMA_HOST, health_ttl=OLLAMA_HEALTH_TTL):
+        self.host = host.rstrip("/")
+        self.health_ttl = health_ttl
+        self._lock = threading.Lock()
+        self._healthy = None
+        self._checked_at = 0.0
+        self._started_at = None  # monotonic time of our last launch
+        self._process = None
+
+    def _request(self, path, payload=None, timeout=2.0):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(
+            f"{self.host}{path}",
+            data=data,
+            headers={"Content-Type": "application/json"},
         )
-    elif system == "Linux":
-        subprocess.Popen(
-            ["ollama", "serve"],
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read() or b"{}")
+
+    def is_healthy(self, force=False):
+        """
+        Whether the API answers, reusing the last probe for health_ttl seconds.
+        """
+        with self._lock:
+            if not force and time.monotonic() - self._checked_at < self.health_ttl:
+                return self._healthy
+        try:
+            self._request("/api/version")
+            healthy = True
+        except (urllib.error.URLError, OSError, ValueError):
+            healthy = False
+        with self._lock:
+            self._healthy = healthy
+            self._checked_at = time.monotonic()
+        return healthy
+
+    def _launch_pending(self):
+        """
+        Whether our last launch is still starting up (or serving) and should not be
+        repeated. A server that exited, or that stays unhealthy past the ready
+        timeout, is treated as crashed: the launch is forgotten so it can be retried.
+        """
+        with self._lock:
+            started_at, process = self._started_at, self._process
+        if started_at is None:
+            return False
+        if self.is_healthy(force=True):
+            return True
+        exited = process is not None and process.poll() is not None
+        if not exited and time.monotonic() - started_at < OLLAMA_READY_TIMEOUT:
+            return True
+        with self._lock:
+            if self._started_at == started_at:
+                self._started_at = self._process = None
+        print("⚠️ Ollama stopped responding.")
+        return False
+
+    def start(self):
+        """
+        Launch the Ollama server in the background, unless our previous launch is
+        still up or starting (see _launch_pending).
+        """
+        if self._launch_pending():
+            return True
+        with self._lock:
+            if self._started_at is not None:
+                return True  # Another thread launched it meanwhile
+            self._started_at = time.monotonic()
+
+        system = platform.system()
+        if system == "Darwin":  # macOS
+            command = ["open", "-a", "Ollama"]
+        elif shutil.which("ollama") is None:
+            print("❌ Ollama not found in PATH.")
+            self._started_at = None
+            return False
+        elif system == "Windows":
+            command = ["cmd", "/c", "start", "ollama", "serve"]
+        elif system == "Linux":
+            command = ["ollama", "serve"]
+        else:
+            print(f"Unsupported OS: {system}")
+            self._started_at = None
+            return False
+
+        print("⚠️ Ollama not running. Starting it now...")
+        process = subprocess.Popen(
+            command,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
+            shell=system == "Windows",
         )
-    else:
-        print(f"Unsupported OS: {system}")
-        return
+        # Only "ollama serve" is the server itself; "open" and "start" exit at once
+        self._process = process if system == "Linux" else None
+        return True
+
+    def wait_until_ready(self, timeout=OLLAMA_READY_TIMEOUT):
+        """
+        Poll the API until it answers; raises TimeoutError after timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+        while not self.is_healthy(force=True):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"Ollama at {self.host} not ready after {timeout:g}s"
+                )
+            time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            delay = min(delay * 2, 2.0)
+
+    def available_models(self):
+        return {m["name"] for m in self._request("/api/tags").get("models", [])}
+
+    def loaded_models(self):
+        return {m["name"] for m in self._request("/api/ps").get("models", [])}
+
+    @staticmethod
+    def _matches(name, names):
+        # "llava" and "llava:latest" are the same model
+        full = name if ":" in name else f"{name}:latest"
+        return name in names or full in names
+
+    def warmup(self, models, keep_alive=OLLAMA_KEEP_ALIVE):
+        """
+        Load models into memory (an empty generate request) unless already loaded,
+        and ask Ollama to keep them resident for keep_alive.
+        """
+        try:
+            loaded = self.loaded_models()
+        except (urllib.error.URLError, OSError, ValueError):
+            loaded = set()
+
+        for model in models:
+            if self._matches(model, loaded):
+                continue
+            start = time.perf_counter()
+            try:
+                self._request(
+                    "/api/generate",
+                    {"model": model, "prompt": "", "keep_alive": keep_alive},
+                    timeout=OLLAMA_WARMUP_TIMEOUT,
+                )
+                print(f"🔥 Loaded {model} in {time.perf_counter() - start:.1f}s.")
+            except urllib.error.HTTPError as e:
+                # e.g. 404 when the model has not been pulled
+                print(f"⚠️ Could not load {model} (HTTP {e.code}), try `ollama pull`.")
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                print(f"⚠️ Could not load {model}: {e}")
+
+    def ensure_ready(self, models=(), timeout=OLLAMA_READY_TIMEOUT):
+        """
+        Make sure the server is up (starting it if needed) and models are loaded.
+        """
+        if not self.is_healthy():
+            if not self.start():
+                raise RuntimeError(f"Ollama is not running at {self.host}")
+            self.wait_until_ready(timeout)
+            print("🚀 Ollama started successfully.")
+        else:
+            print("✅ Ollama is running.")
+        if models:
+            self.warmup(models)
+
+
+_default_server = None
+_default_server_lock = threading.Lock()
+
+
+def get_ollama_server():
+    """
+    Return the process-wide Ollama manager for OLLAMA_HOST.
+    """
+    global _default_server
+    with _default_server_lock:
+        if _default_server is None:
+            _default_server = OllamaServer()
+    return _default_server
+
+
+def ensure_ollama_running(models=None, timeout=OLLAMA_READY_TIMEOUT):
+    """
+    Ensure Ollama is ready and the summarization models are loaded.
+    """
+    if models is None:
+        from summarizer import IMAGE_MODEL, TEXT_MODEL
 
-    print("🚀 Ollama started successfully.")
+        models = (TEXT_MODEL, IMAGE_MODEL)
+    get_ollama_server().ensure_ready(models, timeout)
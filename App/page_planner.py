@@ -0,0 +1,110 @@
+import os
+import re
+
+from pypdf import PdfReader
+
+# Pages with less extractable text than this are treated as scanned (need OCR)
+MIN_TEXT_CHARS = int(os.getenv("PLANNER_MIN_TEXT_CHARS", "200"))
+# Images smaller than this (in pixels, either side) are logos/bullets and ignored
+MIN_IMAGE_SIDE = int(os.getenv("PLANNER_MIN_IMAGE_SIDE", "64"))
+# Ruled tables draw many rectangles/lines; this many path ops marks a page table-like
+TABLE_PATH_OPS = int(os.getenv("PLANNER_TABLE_PATH_OPS", "40"))
+# Lines that look like table rows (3+ cells, mostly numeric) needed to flag a table
+TABLE_ROW_LINES = int(os.getenv("PLANNER_TABLE_ROW_LINES", "4"))
+# Maximum pages per shard partitioned in one unstructured call
+SHARD_PAGES = int(os.getenv("PARTITION_SHARD_PAGES", "25"))
+
+_PATH_OP = re.compile(rb"(?<![A-Za-z])(?:re|l)(?![A-Za-z])")
+_NUMBER = re.compile(r"^[-+(]?[$€£]?\d[\d.,%)]*$")
+
+
+def _image_count(page):
+    count = 0
+    try:
+        xobjects = page["/Resources"]["/XObject"].get_object()
+    except (KeyError, TypeError, AttributeError):
+        return 0
+    for name in xobjects:
+        xobject = xobjects[name].get_object()
+        if xobject.get("/Subtype") != "/Image":
+            continue
+        if min(xobject.get("/Width", 0), xobject.get("/Height", 0)) >= MIN_IMAGE_SIDE:
+            count += 1
+    return count
+
+
+def _path_ops(page):
+    try:
+        contents = page.get_contents()
+        data = contents.get_data() if contents is not None else b""
+    except Exception:
+        return 0
+    return len(_PATH_OP.findall(data))
+
+
+def _table_rows(text):
+    rows = 0
+    for line in text.splitlines():
+        cells = line.split()
+        if len(cells) >= 3 and sum(bool(_NUMBER.match(c)) for c in cells) >= 2:
+            rows += 1
+    return rows
+
+
+def classify_page(page, number):
+    """
+    Cheap features of one page and whether it needs the hi_res strategy.
+    """
+    text = page.extract_text() or ""
+    info = {
+        "page": number,
+        "text_chars": len(text.strip()),
+        "images": _image_count(page),
+        "path_ops": _path_ops(page),
+        "table_rows": _table_rows(text),
+    }
+    info["table_like"] = (
+        info["path_ops"] >= TABLE_PATH_OPS or info["table_rows"] >= TABLE_ROW_LINES
+    )
+    info["needs_hi_res"] = bool(
+        info["images"] or info["table_like"] or info["text_chars"] < MIN_TEXT_CHARS
+    )
+    return info
+
+
+def classify_pages(file_path):
+    """
+    Classify every page of a PDF (1-based page numbers).
+    """
+    reader = PdfReader(file_path)
+    return [classify_page(page, i + 1) for i, page in enumerate(reader.pages)]
+
+
+def plan_shards(pages, shard_pages=SHARD_PAGES):
+    """
+    Group consecutive pages with the same strategy into shards of at most
+    shard_pages pages. Returns [{"strategy", "first_page", "last_page"}, ...].
+    """
+    shards = []
+    for info in pages:
+        strategy = "hi_res" if info["needs_hi_res"] else "fast"
+        last = shards[-1] if shards else None
+        if (
+            last is not None
+            and last["strategy"] == strategy
+            and last["last_page"] == info["page"] - 1
+            and last["last_page"] - last["first_page"] + 1 < shard_pages
+        ):
+            last["last_page"] = info["page"]
+        else:
+            page = info["page"]
+            shards.append({"strategy": strategy, "first_page": page, "last_page": page})
+    return shards
+
+
+def plan_pdf(file_path, shard_pages=SHARD_PAGES):
+    """
+    Classify a PDF's pages and plan its shards. Returns (pages, shards).
+    """
+    pages = classify_pages(file_path)
+    return pages, plan_shards(pages, shard_pages)
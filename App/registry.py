@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+
+# Process-wide registry of heavy, thread-safe objects (embedding model, LLM clients,
+# compiled chains) shared by every Streamlit session and console run.
+_registry = {}
+_registry_lock = threading.Lock()
+_key_locks = {}
+
+
+def get_or_create(key, factory):
+    """
+    Return the object registered under key, building it with factory() exactly once
+    even when several threads ask for it concurrently.
+    """
+    obj = _registry.get(key)
+    if obj is not None:
+        return obj
+
+    with _registry_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Per-key lock: loading one model never blocks lookups of another
+    with key_lock:
+        obj = _registry.get(key)
+        if obj is None:
+            obj = factory()
+            _registry[key] = obj
+    return obj
+
+
+def clear_registry():
+    with _registry_lock:
+        _registry.clear()
+        _key_locks.clear()
+
+
+def get_embedding_model():
+    from embeddings import create_embeddings
+
+    return get_or_create("embeddings", create_embeddings)
+
+
+def get_reranker():
+    from reranker import CrossEncoderReranker
+
+    return get_or_create("reranker", CrossEncoderReranker)
+
+
+def get_chat_ollama(model, **kwargs):
+    """
+    Shared ChatOllama client per model and settings. Clients talk to OLLAMA_HOST and
+    ask the server to keep the model loaded between batches.
+    """
+    from langchain_ollama import ChatOllama
+    from ollama_running import OLLAMA_HOST, OLLAMA_KEEP_ALIVE
+    from telemetry import LLMTelemetryHandler
+
+    kwargs.setdefault("base_url", OLLAMA_HOST)
+    kwargs.setdefault("keep_alive", OLLAMA_KEEP_ALIVE)
+    key = f"ollama:{model}:{json.dumps(kwargs, sort_keys=True, default=str)}"
+    return get_or_create(
+        key,
+        lambda: ChatOllama(
+            model=model, callbacks=[LLMTelemetryHandler(model)], **kwargs
+        ),
+    )
+
+
+def get_chat_openai(model="gpt-4o-mini", temperature=0):
+    from langchain_openai import ChatOpenAI
+    from telemetry import LLMTelemetryHandler
+
+    def factory():
+        return ChatOpenAI(
+            model=model,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            temperature=temperature,
+            callbacks=[LLMTelemetryHandler(model)],
+            # Report token usage on streamed responses too
+            stream_usage=True,
+        )
+
+    return get_or_create(f"openai:{model}:{temperature}", factory)
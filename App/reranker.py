@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+
+from telemetry import increment, observe
+
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Rerank retrieval results by default ("1") or only when asked per call ("0")
+RERANK_ENABLED = os.getenv("RERANK", "0") == "1"
+# Candidates fetched (dense/hybrid) and scored before keeping the top k
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+# Wall-time budget for scoring; remaining candidates keep their first-stage order
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "200"))
+# Passages are cut to this many characters before scoring (the model reads ~512 tokens)
+RERANK_MAX_CHARS = int(os.getenv("RERANK_MAX_CHARS", "1500"))
+# After this many skipped queries, one batch is scored anyway to re-measure its time
+RERANK_PROBE_EVERY = int(os.getenv("RERANK_PROBE_EVERY", "10"))
+
+
+def _is_image(doc):
+    return (getattr(doc, "metadata", None) or {}).get("modality") == "image"
+
+
+class CrossEncoderReranker:
+    """
+    Second-stage ranking with a small CPU cross-encoder over (query, passage) pairs.
+
+    Candidates are scored in batches until the latency budget runs out: if even one
+    batch is expected to exceed it, reranking is skipped; if it runs out midway, the
+    scored candidates are ranked first and the rest keep their first-stage order.
+    Images have no passage text, so they keep their first-stage positions.
+    While skipping, every probe_every-th query scores one batch to re-measure, so one
+    slow batch (e.g. a cold model) does not disable reranking for good.
+    """
+
+    def __init__(
+        self,
+        model=RERANK_MODEL,
+        batch_size=RERANK_BATCH_SIZE,
+        budget_ms=RERANK_BUDGET_MS,
+        max_chars=RERANK_MAX_CHARS,
+        probe_every=RERANK_PROBE_EVERY,
+    ):
+        self.model_name = model
+        self.batch_size = batch_size
+        self.budget = budget_ms / 1000
+        self.max_chars = max_chars
+        self.probe_every = probe_every
+        self._model = None
+        self._lock = threading.Lock()
+        # Running estimate of one batch's scoring time, for the skip decision
+        self._batch_seconds = None
+        self._skipped = 0
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+
+                self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def _score_within_budget(self, query, passages):
+        model = self._load()
+        start = time.perf_counter()
+        scores = []
+        for i in range(0, len(passages), self.batch_size):
+            elapsed = time.perf_counter() - start
+            probe = False
+            if (
+                self._batch_seconds is not None
+                and elapsed + self._batch_seconds > self.budget
+            ):
+                if scores or self._skipped + 1 < self.probe_every:
+                    self._skipped += not scores
+                    increment(
+                        "rerank_budget_exceeded", skipped="no" if scores else "yes"
+                    )
+                    break
+                probe = True
+                self._skipped = 0
+            batch_start = time.perf_counter()
+            batch = passages[i : i + self.batch_size]
+            scores += model.predict(
+                [(query, p) for p in batch], batch_size=self.batch_size
+            ).tolist()
+            seconds = (time.perf_counter() - batch_start) * self.batch_size / len(batch)
+            # A probe replaces the estimate, so a recovered model is used again
+            self._batch_seconds = (
+                seconds
+                if self._batch_seconds is None or probe
+                else 0.8 * self._batch_seconds + 0.2 * seconds
+            )
+        observe("rerank", time.perf_counter() - start)
+        return scores
+
+    def rerank(self, query, docs, top_k):
+        """
+        Return the top_k of docs (in first-stage order) after cross-encoder scoring.
+        """
+        textual = [d for d in docs if not _is_image(d)]
+        if len(textual) <= 1:
+            return docs[:top_k]
+
+        passages = [d.page_content[: self.max_chars] for d in textual]
+        scores = self._score_within_budget(query, passages)
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        # Unscored candidates (budget ran out) follow in their first-stage order
+        order += range(len(scores), len(textual))
+        ranked_text = iter(textual[i] for i in order)
+
+        results = []
+        for doc in docs[:top_k]:
+            if _is_image(doc):
+                results.append(doc)
+            else:
+                results.append(next(ranked_text))
+        return results
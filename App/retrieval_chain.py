@@ -1,47 +1,88 @@
+from typing import List, TypedDict
+
+from langchain_core.documents import Document
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.messages import HumanMessage
 from langchain_core.output_parsers import StrOutputParser
 from base64 import b64decode
-from langchain_openai import ChatOpenAI
-import os
+import asyncio
+import time
 from dotenv import load_dotenv
 
-load_dotenv(verbose=True)
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+from context_packer import pack_context
+from image_utils import image_data_url
+from registry import get_chat_openai, get_or_create
+from telemetry import increment, observe, span
 
-llm = ChatOpenAI(model="gpt-4o-mini", api_key=OPENAI_API_KEY, temperature=0)
+load_dotenv(verbose=True)
 
 
-def retriever_func(question, retriever):
+def retriever_func(question, retriever, search_mode=None):
     """Use the retriever instance returned from VectorDB.initialize_vector_db"""
-    return retriever.invoke(question, kw_args={"k": 3})
+    return retriever.invoke(question, k=3, search_mode=search_mode)
+
+
+class RetrievedContext(TypedDict):
+    """Retrieved documents grouped by modality, as consumed by build_prompt."""
+
+    texts: List[Document]
+    tables: List[Document]
+    images: List[str]
+    sources: List[str]
+
+
+def _legacy_modality(content):
+    # Documents ingested before modality tags existed: fall back to base64 sniffing
+    try:
+        b64decode(content, validate=True)
+        return "image"
+    except Exception:
+        return "text"
 
 
 def parse_docs(docs):
-    b64 = []
-    text = []
+    texts, tables, images, sources = [], [], [], []
 
-    for doc in docs:
-        content = doc.page_content if hasattr(doc, "page_content") else str(doc)
-        try:
-            b64decode(content)
-            b64.append(content)
-        except Exception:
-            text.append(doc)
+    for rank, doc in enumerate(docs):
+        metadata = getattr(doc, "metadata", None)
+        if isinstance(metadata, dict) and "modality" in metadata:
+            modality = metadata["modality"]
+            content = doc.page_content
+        else:
+            content = doc.page_content if hasattr(doc, "page_content") else str(doc)
+            modality = _legacy_modality(content)
+            metadata = {"modality": modality}
+        # Copy so the retrieval rank never leaks back into the docstore objects
+        doc = Document(page_content=content, metadata={**metadata, "rank": rank})
+
+        if modality == "image":
+            images.append(doc.page_content)
+        elif modality == "table":
+            tables.append(doc)
+        else:
+            texts.append(doc)
+
+        source = doc.metadata.get("source")
+        if source and source not in sources:
+            sources.append(source)
 
-    return {"images": b64, "texts": text}
+    return RetrievedContext(texts=texts, tables=tables, images=images, sources=sources)
 
 
 def build_prompt(kwargs):
-    docs_by_type = kwargs["context"]
+    with span("prompt_build"):
+        return _build_prompt(kwargs)
+
+
+def _build_prompt(kwargs):
     user_question = kwargs["question"]
+    packed = kwargs.get("packed") or pack_context(kwargs["context"])
+    increment("prompt_tokens", packed["text_tokens"], modality="text")
+    increment("prompt_tokens", packed["image_tokens"], modality="image")
 
     context_text = ""
-    for text_element in docs_by_type["texts"]:
-        if hasattr(text_element, "page_content"):
-            context_text += text_element.page_content + "\n\n"
-        else:
-            context_text += str(text_element) + "\n\n"
+    for chunk in packed["texts"]:
+        context_text += chunk + "\n\n"
 
     prompt_template = f"""Answer the question based only on the following context, which can include text, tables, and images.
 
@@ -52,26 +93,196 @@ Question: {user_question}
 
     prompt_content = [{"type": "text", "text": prompt_template}]
 
-    for image in docs_by_type["images"]:
+    for image in packed["images"]:
         prompt_content.append(
             {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{image}"},
+                "image_url": {"url": image_data_url(image)},
             }
         )
 
     return [HumanMessage(content=prompt_content)]
 
 
-def answer_question(question, retriever):
+def answer_question(question, retriever, use_cache=True):
     """MAIN FUNCTION – Uses the retriever created in VectorDB.initialize_vector_db"""
-    chain_with_sources = {
-        "context": (lambda q: retriever_func(q, retriever))
-        | RunnableLambda(parse_docs),
-        "question": RunnablePassthrough(),
-    } | RunnablePassthrough().assign(
-        response=(RunnableLambda(build_prompt) | llm | StrOutputParser())
-    )
+    cache = getattr(retriever, "answer_cache", None) if use_cache else None
+    if cache is None:
+        start = time.perf_counter()
+        answer = _answer_question(question, retriever)
+        observe("answer", time.perf_counter() - start, cached=False)
+        return answer
+
+    start = time.perf_counter()
+    corpus_version = retriever.corpus_version
+    answer, vector = cache.lookup(question, corpus_version)
+    if answer is not None:
+        cache.record(hit=True, seconds=time.perf_counter() - start)
+        return answer
+
+    answer = _answer_question(question, retriever)
+    cache.store(question, answer, corpus_version, vector=vector)
+    cache.record(hit=False, seconds=time.perf_counter() - start)
+    return answer
+
+
+def build_context_chain():
+    """
+    Retrieval part of the answer chain: retrieve, group by modality, pack into budget.
+    Input: {"question": ..., "retriever": ...}.
+    """
+    return RunnablePassthrough.assign(
+        context=RunnableLambda(lambda x: retriever_func(x["question"], x["retriever"]))
+        | RunnableLambda(parse_docs)
+    ).assign(packed=lambda x: pack_context(x["context"]))
+
+
+def build_generation_chain():
+    """
+    Generation part of the answer chain: prompt → GPT-4o-mini → text.
+    """
+    return RunnableLambda(build_prompt) | get_chat_openai() | StrOutputParser()
+
+
+def build_answer_chain():
+    """
+    Answer chain compiled once per process. Input: {"question": ..., "retriever": ...}.
+    """
+    return get_context_chain().assign(response=get_generation_chain())
+
+
+def get_context_chain():
+    return get_or_create("context_chain", build_context_chain)
+
+
+def get_generation_chain():
+    return get_or_create("generation_chain", build_generation_chain)
+
 
-    response = chain_with_sources.invoke(question)
+def get_answer_chain():
+    return get_or_create("answer_chain", build_answer_chain)
+
+
+def _answer_question(question, retriever):
+    response = get_answer_chain().invoke({"question": question, "retriever": retriever})
     return response["response"]
+
+
+def answer_questions(questions, retriever, k=3, max_concurrency=8, search_mode=None):
+    """
+    Batch version of answer_question for evaluation and bulk workloads.
+    Retrieval runs in bulk (see HybridMultiVectorRetriever.batch_retrieve) and the LLM
+    calls run with bounded concurrency. Returns, in input order, dicts with the
+    question, answer and the RetrievedContext the answer was based on, plus error
+    (None, or the message of a failed LLM call, whose answer is then "").
+    """
+    questions = list(questions)
+    if not questions:
+        return []
+
+    if hasattr(retriever, "batch_retrieve"):
+        all_docs = retriever.batch_retrieve(questions, k=k, search_mode=search_mode)
+    else:
+        kwargs = (
+            {"k": k} if search_mode is None else {"k": k, "search_mode": search_mode}
+        )
+        all_docs = [retriever.invoke(q, **kwargs) for q in questions]
+
+    states = []
+    for question, docs in zip(questions, all_docs):
+        context = parse_docs(docs)
+        states.append(
+            {"question": question, "context": context, "packed": pack_context(context)}
+        )
+
+    answers = get_generation_chain().batch(
+        states, {"max_concurrency": max_concurrency}, return_exceptions=True
+    )
+
+    results = []
+    for state, answer in zip(states, answers):
+        error = None
+        if isinstance(answer, Exception):
+            print(f"⚠️ Failed to answer '{state['question'][:60]}': {answer}")
+            answer, error = "", f"{type(answer).__name__}: {answer}"
+        results.append(
+            {
+                "question": state["question"],
+                "answer": answer,
+                "context": state["context"],
+                "error": error,
+            }
+        )
+    return results
+
+
+def _sources_event(state, cached=False):
+    return {
+        "type": "sources",
+        "sources": state["context"]["sources"] if state else [],
+        "dropped": state["packed"]["dropped"] if state else [],
+        "cached": cached,
+    }
+
+
+def stream_answer(question, retriever, use_cache=True):
+    """
+    Streaming variant of answer_question. Yields a {"type": "sources", ...} event as
+    soon as retrieval finishes, then {"type": "token", "content": ...} events as the
+    LLM produces them.
+    """
+    cache = getattr(retriever, "answer_cache", None) if use_cache else None
+    start = time.perf_counter()
+
+    if cache is not None:
+        corpus_version = retriever.corpus_version
+        answer, vector = cache.lookup(question, corpus_version)
+        if answer is not None:
+            cache.record(hit=True, seconds=time.perf_counter() - start)
+            yield _sources_event(None, cached=True)
+            yield {"type": "token", "content": answer}
+            return
+
+    state = get_context_chain().invoke({"question": question, "retriever": retriever})
+    yield _sources_event(state)
+
+    tokens = []
+    for token in get_generation_chain().stream(state):
+        tokens.append(token)
+        yield {"type": "token", "content": token}
+
+    if cache is not None:
+        cache.store(question, "".join(tokens), corpus_version, vector=vector)
+        cache.record(hit=False, seconds=time.perf_counter() - start)
+
+
+async def astream_answer(question, retriever, use_cache=True):
+    """
+    Async iterator version of stream_answer, yielding the same events.
+    """
+    cache = getattr(retriever, "answer_cache", None) if use_cache else None
+    start = time.perf_counter()
+
+    if cache is not None:
+        corpus_version = retriever.corpus_version
+        # Lookup may embed the question, which is CPU-bound
+        answer, vector = await asyncio.to_thread(cache.lookup, question, corpus_version)
+        if answer is not None:
+            cache.record(hit=True, seconds=time.perf_counter() - start)
+            yield _sources_event(None, cached=True)
+            yield {"type": "token", "content": answer}
+            return
+
+    state = await get_context_chain().ainvoke(
+        {"question": question, "retriever": retriever}
+    )
+    yield _sources_event(state)
+
+    tokens = []
+    async for token in get_generation_chain().astream(state):
+        tokens.append(token)
+        yield {"type": "token", "content": token}
+
+    if cache is not None:
+        cache.store(question, "".join(tokens), corpus_version, vector=vector)
+        cache.record(hit=False, seconds=time.perf_counter() - start)
@@ -1,12 +1,75 @@
+import os
+from base64 import b64decode
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama import ChatOllama
 from langchain_core.output_parsers import StrOutputParser
 
+from image_utils import image_data_url
+from manifest import element_content
+from registry import get_chat_ollama
+from summary_cache import content_key, get_summary_cache
+from telemetry import increment, span
 
-def summarize_texts_tables(texts, tables):
+TEXT_MODEL = "gemma:2b"
+IMAGE_MODEL = "llava"
+
+# Bump these whenever the corresponding prompt changes so cached summaries are not reused
+TEXT_PROMPT_VERSION = "v1"
+IMAGE_PROMPT_VERSION = "v1"
+
+# Image summarization runs concurrently against Ollama
+IMAGE_MAX_CONCURRENCY = int(os.getenv("IMAGE_MAX_CONCURRENCY", "4"))
+IMAGE_REQUEST_TIMEOUT = float(os.getenv("IMAGE_REQUEST_TIMEOUT", "120"))
+IMAGE_MAX_RETRIES = 3
+IMAGE_RETRY_BACKOFF = 1.0
+
+
+def _cached_batch(
+    items, contents, model_name, prompt_version, run_batch, cache, modality
+):
+    """
+    Look up summaries in the cache and only run the LLM for the missing items.
+    """
+    keys = [content_key(c, model_name, prompt_version) for c in contents]
+    summaries = cache.get_many(keys)
+
+    missing = [i for i, k in enumerate(keys) if k not in summaries]
+    increment("cache_lookups", len(keys) - len(missing), cache="summary", result="hit")
+    increment("cache_lookups", len(missing), cache="summary", result="miss")
+    if missing:
+        increment("summarized", len(missing), modality=modality)
+        size = sum(len(_as_bytes(contents[i])) for i in missing)
+        increment("summarized_bytes", size, modality=modality)
+        with span("summarize_batch", modality=modality, model=model_name):
+            fresh = run_batch([items[i] for i in missing])
+        new_entries = {}
+        for i, s in zip(missing, fresh):
+            s = s if isinstance(s, str) else s.content
+            summaries[keys[i]] = s
+            # Never cache empty/failed summaries
+            if s and s.strip():
+                new_entries[keys[i]] = s
+        cache.set_many(new_entries)
+
+    return [summaries[k] for k in keys]
+
+
+def _as_bytes(content):
+    return content.encode("utf-8") if isinstance(content, str) else content
+
+
+def _image_content(b64):
+    try:
+        return b64decode(b64)
+    except Exception:
+        return b64
+
+
+def summarize_texts_tables(texts, tables, cache=None):
     """
     Summarize texts and tables using Ollama model.
     """
+    cache = cache or get_summary_cache()
+
     # Concise summary prompt (1-2 sentences)
     prompt_text = """
 Summarize the following table or text concisely in 1-2 sentences.
@@ -16,51 +79,105 @@ Input: {element}
 """
 
     prompt = ChatPromptTemplate.from_template(prompt_text)
-    model = ChatOllama(temperature=0.5, model="gemma:2b", verbose=False)
+    model = get_chat_ollama(TEXT_MODEL, temperature=0.5, verbose=False)
     summarize_chain = {"element": lambda x: x} | prompt | model | StrOutputParser()
 
+    def run_batch(batch):
+        return summarize_chain.batch(batch, {"max_concurrency": 3})
+
     # Summarize texts
-    raw_text_summaries = summarize_chain.batch(texts, {"max_concurrency": 3})
-    text_summaries = [
-        s if isinstance(s, str) else s.content for s in raw_text_summaries
-    ]
+    text_contents = [t.text if hasattr(t, "text") else str(t) for t in texts]
+    text_summaries = _cached_batch(
+        texts, text_contents, TEXT_MODEL, TEXT_PROMPT_VERSION, run_batch, cache, "text"
+    )
 
-    # Summarize tables
-    tables_html = [table.metadata.text_as_html for table in tables]
-    raw_table_summaries = summarize_chain.batch(tables_html, {"max_concurrency": 3})
-    table_summaries = [
-        s if isinstance(s, str) else s.content for s in raw_table_summaries
+    # Summarize tables (as HTML when partitioning inferred their structure)
+    tables_html = [
+        getattr(getattr(table, "metadata", None), "text_as_html", None)
+        or element_content(table)
+        for table in tables
     ]
+    table_summaries = _cached_batch(
+        tables_html,
+        tables_html,
+        TEXT_MODEL,
+        TEXT_PROMPT_VERSION,
+        run_batch,
+        cache,
+        "table",
+    )
+
+    stats = cache.stats()
+    print(f"🗃️ Summary cache: {stats['hits']} hits, {stats['misses']} misses.")
 
     return text_summaries, table_summaries
 
 
-def summarize_images(images_b64):
+def _image_message(b64):
+    # Build data URL for LangChain ChatOllama wrapper
+    data_url = image_data_url(b64)
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": "Describe this image accurately, in technical detail.",
+                },
+                {"type": "image_url", "image_url": {"url": data_url}},
+            ],
+        }
+    ]
+
+
+def summarize_images(
+    images_b64,
+    cache=None,
+    max_concurrency=IMAGE_MAX_CONCURRENCY,
+    timeout=IMAGE_REQUEST_TIMEOUT,
+    max_retries=IMAGE_MAX_RETRIES,
+    backoff=IMAGE_RETRY_BACKOFF,
+):
     """
     Summarize images using LLaVA model.
+    Requests run concurrently (bounded by max_concurrency), each with its own timeout
+    and retries with exponential backoff; results keep the input order and a failed
+    image yields an empty summary instead of failing the whole batch.
     """
-    llm = ChatOllama(model="llava", temperature=0.0)
-    parser = StrOutputParser()
-    summaries = []
-
-    for b64 in images_b64:
-        # Build data URL for LangChain ChatOllama wrapper
-        data_url = f"data:image/jpeg;base64,{b64}"
-
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": "Describe this image accurately, in technical detail.",
-                    },
-                    {"type": "image_url", "image_url": {"url": data_url}},
-                ],
-            }
-        ]
-
-        resp = llm.invoke(messages)
-        summaries.append(parser.parse(resp))
-
-    return summaries
+    cache = cache or get_summary_cache()
+    llm = get_chat_ollama(
+        IMAGE_MODEL, temperature=0.0, client_kwargs={"timeout": timeout}
+    )
+    summarize_chain = (
+        llm.with_retry(
+            wait_exponential_jitter=True,
+            exponential_jitter_params={"initial": backoff},
+            stop_after_attempt=max_retries,
+        )
+        | StrOutputParser()
+    )
+
+    def run_batch(batch):
+        messages = [_image_message(b64) for b64 in batch]
+        results = summarize_chain.batch(
+            messages, {"max_concurrency": max_concurrency}, return_exceptions=True
+        )
+        summaries = []
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"⚠️ Image summarization failed: {result}")
+                summaries.append("")
+            else:
+                summaries.append(result)
+        return summaries
+
+    image_contents = [_image_content(b64) for b64 in images_b64]
+    return _cached_batch(
+        images_b64,
+        image_contents,
+        IMAGE_MODEL,
+        IMAGE_PROMPT_VERSION,
+        run_batch,
+        cache,
+        "image",
+    )
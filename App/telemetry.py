@@ -0,0 +1,260 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# JSON-lines span/counter log (disabled when unset)
+TELEMETRY_LOG_PATH = os.getenv("TELEMETRY_LOG_PATH")
+# Prometheus text-format snapshot written by write_metrics(); when unset, callers pass
+# a path in the app's data directory (see VectorDB.get_metrics_path)
+METRICS_PATH = os.getenv("METRICS_PATH")
+# Serve /metrics over HTTP on this port when set (see start_metrics_server)
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Interface the /metrics server binds to (0.0.0.0 exposes it beyond this machine)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PREFIX = "rag"
+
+_lock = threading.Lock()
+# (stage, labels) -> (count, total seconds, max seconds)
+_stages = {}
+# (name, labels) -> value
+_counters = {}
+# The log has its own lock and one line-buffered handle, opened on first use
+_log_lock = threading.Lock()
+_log_file = None
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _log(event):
+    global _log_file
+    if not TELEMETRY_LOG_PATH:
+        return
+    line = json.dumps(event, default=str)
+    with _log_lock:
+        if _log_file is None:
+            _log_file = open(TELEMETRY_LOG_PATH, "a", encoding="utf-8", buffering=1)
+        _log_file.write(line + "\n")
+
+
+@atexit.register
+def _close_log():
+    global _log_file
+    with _log_lock:
+        if _log_file is not None:
+            _log_file.close()
+            _log_file = None
+
+
+def observe(stage, seconds, **labels):
+    """
+    Record one timed occurrence of a pipeline stage.
+    """
+    key = (stage, _label_key(labels))
+    with _lock:
+        count, total, peak = _stages.get(key, (0, 0.0, 0.0))
+        _stages[key] = (count + 1, total + seconds, max(peak, seconds))
+    _log({"ts": time.time(), "span": stage, "seconds": round(seconds, 6), **labels})
+
+
+def increment(name, value=1, **labels):
+    """
+    Add value to a counter, e.g. increment("elements", 12, modality="text").
+    """
+    if not value:
+        return
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _log({"ts": time.time(), "counter": name, "value": value, **labels})
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Time a block as one occurrence of stage:
+
+        with span("retrieval", mode="hybrid"):
+            ...
+
+    The span is recorded (with error=<exception type>) even when the block raises.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        labels["error"] = type(e).__name__
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, **labels)
+
+
+class LLMTelemetryHandler(BaseCallbackHandler):
+    """
+    Callback handler recording an "llm_call" span and token counters per model.
+    Works for invoke, batch and stream, since it hooks the model run itself.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._starts = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            observe("llm_call", time.perf_counter() - start, model=self.model)
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if usage:
+                    tokens_in = usage.get("input_tokens", 0)
+                    tokens_out = usage.get("output_tokens", 0)
+                    increment("llm_input_tokens", tokens_in, model=self.model)
+                    increment("llm_output_tokens", tokens_out, model=self.model)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            observe(
+                "llm_call",
+                time.perf_counter() - start,
+                model=self.model,
+                error=type(error).__name__,
+            )
+
+
+def snapshot():
+    """
+    Current stage timings and counters as plain dicts (for logs, UIs and tests).
+    """
+    with _lock:
+        stages = [
+            {
+                "stage": stage,
+                "labels": dict(labels),
+                "count": count,
+                "seconds": total,
+                "max_seconds": peak,
+            }
+            for (stage, labels), (count, total, peak) in sorted(_stages.items())
+        ]
+        counters = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+    return {"stages": stages, "counters": counters}
+
+
+def reset_metrics():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for k, v in labels:
+        v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{k}="{v}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def render_prometheus():
+    """
+    Metrics in the Prometheus text exposition format.
+    """
+    p = METRICS_PREFIX
+    lines = [
+        f"# HELP {p}_stage_seconds Wall time spent per pipeline stage.",
+        f"# TYPE {p}_stage_seconds summary",
+    ]
+    with _lock:
+        stages = sorted(_stages.items())
+        counters = sorted(_counters.items())
+
+    for (stage, labels), (count, total, _) in stages:
+        label_str = _format_labels((("stage", stage),) + labels)
+        lines.append(f"{p}_stage_seconds_count{label_str} {count}")
+        lines.append(f"{p}_stage_seconds_sum{label_str} {total:.6f}")
+
+    lines.append(f"# HELP {p}_stage_seconds_max Slowest occurrence of each stage.")
+    lines.append(f"# TYPE {p}_stage_seconds_max gauge")
+    for (stage, labels), (_, _, peak) in stages:
+        label_str = _format_labels((("stage", stage),) + labels)
+        lines.append(f"{p}_stage_seconds_max{label_str} {peak:.6f}")
+
+    seen = set()
+    for (name, labels), value in counters:
+        metric = f"{p}_{name}_total"
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path=None):
+    """
+    Write a Prometheus text snapshot (e.g. for node_exporter's textfile collector)
+    to METRICS_PATH if set, else to path. No-op when neither is set.
+    """
+    path = METRICS_PATH or path
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    Serve /metrics on a daemon thread, once per process. No-op when port is unset.
+    """
+    global _server
+    if not port:
+        return None
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            threading.Thread(
+                target=_server.serve_forever, name="metrics-server", daemon=True
+            ).start()
+            print(f"📈 Serving metrics on http://{host}:{port}/metrics")
+    return _server
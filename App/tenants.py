@@ -0,0 +1,312 @@
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from answer_cache import SemanticAnswerCache
+from chunk_store import close_chunk_store
+from dedup import DEDUP_ENABLED, NearDuplicateIndex
+from lexical_index import BM25Index
+from registry import get_or_create
+from VectorDB import (
+    DEFAULT_SEARCH_MODE,
+    HybridMultiVectorRetriever,
+    initialize_vector_db,
+)
+
+# One store shared by every session; tenants are separated by metadata filters
+TENANT_STORE_DIR = os.getenv(
+    "TENANT_STORE_DIR", os.path.join(tempfile.gettempdir(), "querydr_store")
+)
+# Per-tenant quotas (0 disables a limit)
+TENANT_MAX_FILES = int(os.getenv("TENANT_MAX_FILES", "20"))
+TENANT_MAX_BYTES = int(os.getenv("TENANT_MAX_BYTES", str(200 * 1024 * 1024)))
+# Tenants whose in-memory state (retriever, BM25 index, answer cache) is kept
+MAX_ACTIVE_TENANTS = int(os.getenv("MAX_ACTIVE_TENANTS", "64"))
+# In-memory state of a tenant idle this long is released (its data stays on disk)
+TENANT_IDLE_SECONDS = float(os.getenv("TENANT_IDLE_SECONDS", "900"))
+# On-disk data of a tenant unseen this long is deleted by the reaper
+TENANT_TTL_SECONDS = float(os.getenv("TENANT_TTL_SECONDS", str(24 * 3600)))
+REAPER_INTERVAL_SECONDS = float(os.getenv("REAPER_INTERVAL_SECONDS", "300"))
+
+_TENANT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class QuotaExceededError(RuntimeError):
+    pass
+
+
+class TenantManager:
+    """
+    Tenant-aware storage for the web app. All tenants share one vector collection and
+    one SQLite docstore, with every document tagged with its tenant_id; each tenant
+    gets a lightweight retriever filtered to its own documents plus its own BM25
+    index, near-duplicate index, answer cache, manifest, chunk store and upload
+    directory.
+
+    In-memory tenant state is kept for at most max_active tenants (LRU) and released
+    after idle_seconds, except for tenants pinned by running ingestion jobs (see
+    pinned); a reaper thread deletes the stored data of tenants not seen for
+    ttl_seconds. Usage (files, bytes, last activity) lives in tenants.sqlite.
+    """
+
+    def __init__(
+        self,
+        store_dir=TENANT_STORE_DIR,
+        max_files=TENANT_MAX_FILES,
+        max_bytes=TENANT_MAX_BYTES,
+        max_active=MAX_ACTIVE_TENANTS,
+        idle_seconds=TENANT_IDLE_SECONDS,
+        ttl_seconds=TENANT_TTL_SECONDS,
+    ):
+        self.store_dir = store_dir
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_active = max_active
+        self.idle_seconds = idle_seconds
+        self.ttl_seconds = ttl_seconds
+
+        os.makedirs(store_dir, exist_ok=True)
+        self.shared = initialize_vector_db(store_dir)
+        self._lock = threading.RLock()
+        self._active = OrderedDict()  # tenant_id -> (retriever, last_used)
+        self._pins = Counter()  # tenant_id -> running users that must keep its state
+        self._reaper = None
+        self._stop = threading.Event()
+
+        self._conn = sqlite3.connect(
+            os.path.join(store_dir, "tenants.sqlite"), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tenants (tenant_id TEXT PRIMARY KEY, "
+            "last_seen REAL NOT NULL, files INTEGER NOT NULL DEFAULT 0, "
+            "bytes INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.commit()
+
+    # ----- paths & bookkeeping -----
+    def tenant_dir(self, tenant_id):
+        if not _TENANT_ID_PATTERN.match(tenant_id):
+            raise ValueError(f"Invalid tenant id: {tenant_id!r}")
+        return os.path.join(self.store_dir, "tenants", tenant_id)
+
+    def upload_dir(self, tenant_id):
+        path = os.path.join(self.tenant_dir(tenant_id), "uploads")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _touch(self, tenant_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO tenants (tenant_id, last_seen) VALUES (?, ?) "
+                "ON CONFLICT(tenant_id) DO UPDATE SET last_seen = excluded.last_seen",
+                (tenant_id, time.time()),
+            )
+            self._conn.commit()
+
+    def usage(self, tenant_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT files, bytes FROM tenants WHERE tenant_id = ?", (tenant_id,)
+            ).fetchone()
+        files, size = row if row else (0, 0)
+        return {"files": files, "bytes": size}
+
+    # ----- retrievers -----
+    def _build_retriever(self, tenant_id):
+        shared = self.shared
+        tenant_dir = self.tenant_dir(tenant_id)
+        os.makedirs(tenant_dir, exist_ok=True)
+        return HybridMultiVectorRetriever(
+            vectorstore=shared.vectorstore,
+            docstore=shared.docstore,
+            id_key=shared.id_key,
+            search_kwargs={"filter": {"tenant_id": tenant_id}},
+            lexical_index=BM25Index(os.path.join(tenant_dir, "bm25_index.pkl")),
+            search_mode=DEFAULT_SEARCH_MODE,
+            answer_cache=SemanticAnswerCache(shared.vectorstore.embeddings),
+            reranker=shared.reranker,
+            dedup_index=(
+                NearDuplicateIndex(os.path.join(tenant_dir, "dedup_index.pkl"))
+                if DEDUP_ENABLED
+                else None
+            ),
+            tenant_id=tenant_id,
+        )
+
+    def get_retriever(self, tenant_id):
+        """
+        Retriever scoped to tenant_id, built on first use and kept while active.
+        """
+        with self._lock:
+            entry = self._active.pop(tenant_id, None)
+            retriever = entry[0] if entry else self._build_retriever(tenant_id)
+            self._active[tenant_id] = (retriever, time.monotonic())
+            # Pinned tenants stay: a second retriever would have its own BM25,
+            # near-duplicate and answer-cache state, overwriting each other's files
+            evictable = [t for t in self._active if not self._pins[t]]
+            for evicted in evictable[: max(len(self._active) - self.max_active, 0)]:
+                del self._active[evicted]
+                print(f"♻️ Released in-memory state of tenant {evicted}.")
+        self._touch(tenant_id)
+        return retriever
+
+    @contextmanager
+    def pinned(self, tenant_id):
+        """
+        Yield the tenant's retriever and keep it in memory until the block exits.
+        """
+        with self._lock:
+            self._pins[tenant_id] += 1
+        try:
+            yield self.get_retriever(tenant_id)
+        finally:
+            with self._lock:
+                self._pins[tenant_id] -= 1
+                if not self._pins[tenant_id]:
+                    del self._pins[tenant_id]
+                if tenant_id in self._active:
+                    # Idle time counts from the end of the pinned work
+                    self._active[tenant_id] = (
+                        self._active[tenant_id][0],
+                        time.monotonic(),
+                    )
+
+    def release_idle(self):
+        """
+        Drop in-memory state of unpinned tenants idle longer than idle_seconds.
+        """
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [
+                t
+                for t, (_, used) in self._active.items()
+                if used < cutoff and not self._pins[t]
+            ]
+            for tenant_id in idle:
+                del self._active[tenant_id]
+        return idle
+
+    # ----- quotas -----
+    def check_quota(self, tenant_id, new_files, new_bytes):
+        """
+        Raise QuotaExceededError if adding the files would exceed the tenant's quota.
+        """
+        usage = self.usage(tenant_id)
+        if self.max_files and usage["files"] + new_files > self.max_files:
+            raise QuotaExceededError(
+                f"File quota exceeded: {usage['files']} of {self.max_files} used."
+            )
+        if self.max_bytes and usage["bytes"] + new_bytes > self.max_bytes:
+            raise QuotaExceededError(
+                f"Storage quota exceeded: {usage['bytes'] / 1e6:.1f} of "
+                f"{self.max_bytes / 1e6:.1f} MB used."
+            )
+
+    def record_upload(self, tenant_id, n_files, n_bytes):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO tenants (tenant_id, last_seen, files, bytes) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(tenant_id) DO UPDATE SET "
+                "last_seen = excluded.last_seen, files = files + excluded.files, "
+                "bytes = bytes + excluded.bytes",
+                (tenant_id, time.time(), n_files, n_bytes),
+            )
+            self._conn.commit()
+
+    # ----- deletion & reaping -----
+    def purge_tenant(self, tenant_id):
+        """
+        Delete every vector, original document and file belonging to a tenant.
+        """
+        with self._lock:
+            self._active.pop(tenant_id, None)
+        vectorstore = self.shared.vectorstore
+        found = vectorstore.get(where={"tenant_id": tenant_id}, include=["metadatas"])
+        if found["ids"]:
+            doc_ids = {
+                m.get(self.shared.id_key) for m in found["metadatas"] if m is not None
+            }
+            vectorstore.delete(ids=found["ids"])
+            self.shared.docstore.mdelete([d for d in doc_ids if d])
+        tenant_dir = self.tenant_dir(tenant_id)
+        close_chunk_store(os.path.join(tenant_dir, "chunk_store"))
+        shutil.rmtree(tenant_dir, ignore_errors=True)
+        with self._lock:
+            self._conn.execute("DELETE FROM tenants WHERE tenant_id = ?", (tenant_id,))
+            self._conn.commit()
+        print(f"🗑️ Purged tenant {tenant_id} ({len(found['ids'])} vectors).")
+
+    def reap(self):
+        """
+        Release idle in-memory state and purge tenants unseen for ttl_seconds.
+        """
+        self.release_idle()
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            stale = [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT tenant_id FROM tenants WHERE last_seen < ?", (cutoff,)
+                )
+            ]
+        for tenant_id in stale:
+            if tenant_id not in self._active:
+                self.purge_tenant(tenant_id)
+
+        # Directories left behind without a tenants row (e.g. a crash mid-purge)
+        tenants_root = os.path.join(self.store_dir, "tenants")
+        if os.path.isdir(tenants_root):
+            with self._lock:
+                rows = self._conn.execute("SELECT tenant_id FROM tenants")
+                known = {row[0] for row in rows}
+            for name in os.listdir(tenants_root):
+                path = os.path.join(tenants_root, name)
+                if name not in known and os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+        return stale
+
+    def start_reaper(self, interval=REAPER_INTERVAL_SECONDS):
+        """
+        Run reap() every interval seconds on a daemon thread (once per manager).
+        """
+        with self._lock:
+            if self._reaper is not None:
+                return
+
+            def loop():
+                while not self._stop.wait(interval):
+                    try:
+                        self.reap()
+                    except Exception as e:
+                        print(f"⚠️ Tenant reaper failed: {e}")
+
+            self._reaper = threading.Thread(
+                target=loop, name="tenant-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def close(self):
+        self._stop.set()
+        if hasattr(self.shared.docstore, "close"):
+            self.shared.docstore.close()
+        self._conn.close()
+
+
+def get_tenant_manager():
+    """
+    Process-wide tenant manager with its reaper running.
+    """
+
+    def factory():
+        manager = TenantManager()
+        manager.start_reaper()
+        return manager
+
+    return get_or_create("tenant_manager", factory)